@@ -1,124 +1,522 @@
-import requests
+from __future__ import annotations
+
+import gzip
+import importlib.util
 import json
+import sys
 import time
+import random
 import argparse
-from typing import Dict
+from typing import TYPE_CHECKING, Any, Dict
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson es opcional; se usa la librería estándar si no está instalado
+    orjson = None
+
+# httpx (y ijson) se importan dentro de las funciones que los usan, para que
+# `--help` y los errores de argumentos no paguen su costo de importación.
+if TYPE_CHECKING:
+    import httpx
+
+# HTTP/2 multiplexa /validate, /query y los sondeos sobre una sola conexión;
+# requiere el paquete opcional `h2` (pip install "httpx[http2]").
+HTTP2_DISPONIBLE = importlib.util.find_spec("h2") is not None
+
+# El cuerpo de las solicitudes se envía tal cual se leyó del archivo.
+JSON_HEADERS = {"Content-Type": "application/json"}
+JSON_GZIP_HEADERS = {**JSON_HEADERS, "Content-Encoding": "gzip"}
+
+# Respuestas de resultados por debajo de este tamaño se leen completas;
+# por encima se decodifican en streaming (si ijson está disponible).
+UMBRAL_STREAMING_BYTES = 256 * 1024
+
+# Archivo donde se guarda el ID de la última consulta creada, para poder
+# reanudar su monitoreo con --resume o --reuse-last.
+ARCHIVO_ULTIMA_CONSULTA = Path(".last_consulta")
+
+# Tiempo máximo sin recibir datos del stream SSE; el servidor envía un
+# comentario de keep-alive cada 15s.
+SSE_READ_TIMEOUT = 45
+
+# Número de sondeos consecutivos sin cambio de progreso antes de espaciar el siguiente.
+MAX_SONDEOS_SIN_AVANCE = 2
+
+# Respuestas transitorias que se reintentan con backoff exponencial (httpx solo
+# reintenta fallos de conexión). POST solo ante 429/503: el servidor no procesó
+# la solicitud, así que reenviarla no duplica la consulta.
+ESTADOS_REINTENTABLES = {
+    "GET": frozenset({429, 502, 503, 504}),
+    "POST": frozenset({429, 503}),
+}
+MAX_REINTENTOS_ESTADO = 3
+BACKOFF_REINTENTOS_SECONDS = 0.5
+
+_BAR = "=" * 25
+
 def print_separator(title: str):
     """Imprime un separador visual para la salida."""
-    print(f"\n{'='*25} {title.upper()} {'='*25}")
+    print(f"\n{_BAR} {title.upper()} {_BAR}")
+
+def _json(response: httpx.Response) -> Any:
+    """Decodifica el cuerpo JSON de una respuesta, con orjson si está disponible."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
 
-def print_response(response: requests.Response):
-    """Imprime de forma legible la respuesta de una solicitud."""
+def _loads(raw: bytes) -> Any:
+    """Decodifica bytes JSON, con orjson si está disponible."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _dumps_legible(data: Any) -> str:
+    """Serializa `data` como JSON indentado, conservando caracteres no ASCII."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+def print_response(response: httpx.Response, raw: bool = False):
+    """
+    Imprime de forma legible la respuesta de una solicitud.
+    Con `raw`, imprime el cuerpo tal como lo envió el servidor, sin decodificarlo.
+    """
     print(f"-> Código de Estado: {response.status_code}")
+    if raw:
+        print(response.content.decode("utf-8", "replace"))
+        return
     try:
         print("-> Respuesta JSON:")
-        print(json.dumps(response.json(), indent=2, ensure_ascii=False))
+        print(_dumps_legible(_json(response)))
     except json.JSONDecodeError:
         print(f"-> Respuesta (No-JSON): {response.text}")
 
-def validar_solicitud_remota(session: requests.Session, base_url: str, json_file_path: str) -> bool:
+class _TransporteConReintentos:
     """
-    Carga y valida una solicitud contra el endpoint /validate.
-    Retorna True si es válida, False en caso contrario.
+    Envuelve un transporte httpx y reintenta las respuestas de ESTADOS_REINTENTABLES,
+    esperando BACKOFF_REINTENTOS_SECONDS * 2**intento (o el Retry-After del servidor).
+    """
+
+    def __init__(self, transporte: httpx.BaseTransport):
+        self._transporte = transporte
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        reintentables = ESTADOS_REINTENTABLES.get(request.method, frozenset())
+        for intento in range(MAX_REINTENTOS_ESTADO + 1):
+            response = self._transporte.handle_request(request)
+            if response.status_code not in reintentables or intento == MAX_REINTENTOS_ESTADO:
+                return response
+            espera = _espera_reintento(response, intento)
+            response.close()
+            time.sleep(espera)
+        return response
+
+    def close(self):
+        self._transporte.close()
+
+    def __enter__(self):
+        self._transporte.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self._transporte.__exit__(*args)
+
+class _TransporteAsyncConReintentos:
+    """Equivalente asíncrono de _TransporteConReintentos, para el httpx.AsyncClient de --batch."""
+
+    def __init__(self, transporte: httpx.AsyncBaseTransport):
+        self._transporte = transporte
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        import asyncio
+
+        reintentables = ESTADOS_REINTENTABLES.get(request.method, frozenset())
+        for intento in range(MAX_REINTENTOS_ESTADO + 1):
+            response = await self._transporte.handle_async_request(request)
+            if response.status_code not in reintentables or intento == MAX_REINTENTOS_ESTADO:
+                return response
+            espera = _espera_reintento(response, intento)
+            await response.aclose()
+            await asyncio.sleep(espera)
+        return response
+
+    async def aclose(self):
+        await self._transporte.aclose()
+
+    async def __aenter__(self):
+        await self._transporte.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self._transporte.__aexit__(*args)
+
+def _espera_reintento(response: httpx.Response, intento: int) -> float:
+    """Segundos antes del siguiente reintento: Retry-After si es un número (máx. 30s), si no backoff exponencial."""
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), 30.0)
+    return BACKOFF_REINTENTOS_SECONDS * (2 ** intento)
+
+def crear_sesion(base_url: str) -> httpx.Client:
+    """
+    Crea un cliente HTTP reutilizable para todas las llamadas al servidor.
+    Mantiene la conexión abierta entre /validate, /query y los sondeos de estado
+    (multiplexada con HTTP/2 si está disponible) y reintenta los fallos de conexión
+    y las respuestas 429/502/503/504.
+    """
+    import httpx
+
+    transport = _TransporteConReintentos(httpx.HTTPTransport(
+        retries=3,
+        http2=HTTP2_DISPONIBLE,
+        limits=httpx.Limits(max_connections=4, max_keepalive_connections=1),
+    ))
+    return httpx.Client(
+        base_url=base_url,
+        transport=transport,
+        timeout=10.0,
+        headers={"Accept": "application/json"},
+    )
+
+def crear_sesion_async(base_url: str) -> httpx.AsyncClient:
+    """Cliente asíncrono para --batch, con los mismos reintentos y HTTP/2 que crear_sesion."""
+    import httpx
+
+    transport = _TransporteAsyncConReintentos(httpx.AsyncHTTPTransport(retries=3, http2=HTTP2_DISPONIBLE))
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=10.0,
+        headers={"Accept": "application/json"},
+    )
+
+class _LectorStream:
+    """Adapta el iterador de bytes de una respuesta httpx a la interfaz `read()` que usa ijson."""
+
+    def __init__(self, response: httpx.Response):
+        self._chunks = response.iter_bytes()
+        # bytearray: agregar al final y descartar lo leído sin recopiar todo el búfer en cada read()
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+def imprimir_resultados(session: httpx.Client, results_url: str, raw_response: bool = False):
+    """
+    Obtiene e imprime los resultados finales de una consulta.
+    Para respuestas grandes imprime cada archivo conforme llega y un resumen
+    final, sin materializar todo el JSON en memoria.
+    """
+    try:
+        import ijson
+    except ImportError:  # ijson es opcional; sin él los resultados se leen completos en memoria
+        ijson = None
+
+    with session.stream("GET", results_url) as response:
+        content_length = int(response.headers.get("Content-Length") or 0)
+        if raw_response or ijson is None or response.status_code != 200 or 0 < content_length < UMBRAL_STREAMING_BYTES:
+            response.read()
+            print_response(response, raw_response)
+            return
+
+        print(f"-> Código de Estado: {response.status_code}")
+        print("-> Archivos recuperados:")
+        resumen = {}
+        totales_por_fuente: Dict[str, int] = {}
+        for prefix, event, value in ijson.parse(_LectorStream(response)):
+            if prefix.endswith(".archivos.item"):
+                # prefix: resultados.fuentes.<fuente>.archivos.item
+                fuente = prefix.split(".")[2]
+                totales_por_fuente[fuente] = totales_por_fuente.get(fuente, 0) + 1
+                print(f"   [{fuente}] {value}")
+            elif prefix.startswith("resultados.") and prefix.count(".") == 1 and event in ("string", "number", "boolean", "null"):
+                resumen[prefix.split(".", 1)[1]] = value
+        print("-> Resumen:")
+        for fuente, total in totales_por_fuente.items():
+            print(f"   {fuente}: {total} archivos listados")
+        for clave, valor in resumen.items():
+            print(f"   {clave}: {valor}")
+
+def cargar_solicitud(json_file_path: str, verbose: bool = False) -> tuple[Any, bytes] | None:
+    """
+    Carga la solicitud desde un archivo JSON.
+    Retorna (datos, bytes_originales) o None si el archivo no se puede leer o no es JSON válido.
+    Solo imprime el JSON completo si `verbose`; si no, un resumen de claves y tamaño.
     """
-    # --- 1. Cargar la solicitud desde el archivo JSON ---
     print_separator(f"Cargando solicitud desde {json_file_path}")
     try:
-        with open(json_file_path, 'r') as f:
-            request_data = json.load(f)
-        print("Solicitud cargada exitosamente.")
-        print(json.dumps(request_data, indent=2, ensure_ascii=False))
+        with open(json_file_path, 'rb') as f:
+            raw = f.read()
+        request_data = _loads(raw)
     except FileNotFoundError:
         print(f"❌ Error: El archivo '{json_file_path}' no fue encontrado.")
-        return False
-    except json.JSONDecodeError:
+        return None
+    except OSError as e:
+        print(f"❌ Error: No se pudo leer el archivo '{json_file_path}': {e.strerror or e}")
+        return None
+    except ValueError:
+        # JSONDecodeError (json u orjson) y UnicodeDecodeError de un archivo que no es UTF-8
         print(f"❌ Error: El archivo '{json_file_path}' no contiene un JSON válido.")
+        return None
+    print("Solicitud cargada exitosamente.")
+    if verbose:
+        print(_dumps_legible(request_data))
+    else:
+        claves = list(request_data) if isinstance(request_data, dict) else []
+        print(f"keys={claves} bytes={len(raw)}")
+    return request_data, raw
+
+def servidor_disponible(session: httpx.Client, base_url: str) -> bool:
+    """
+    Comprueba con un GET a /health que el servidor responde, antes de enviar el
+    cuerpo (posiblemente grande) de la solicitud. Cualquier respuesta HTTP, incluso
+    un 404 de servidores sin /health, cuenta como disponible. Solo un ConnectError
+    (conexión rechazada, DNS) cuenta como caído: /health revisa la ruta de Lustre y
+    puede tardar en un montaje ocupado, así que un timeout no descarta el servidor.
+    """
+    import httpx
+
+    try:
+        session.get(f"{base_url}/health", timeout=2)
+    except httpx.ConnectError:
+        print(f"❌ Error de conexión: No se pudo conectar a {base_url}. ¿Está el servidor corriendo?")
+        return False
+    except httpx.TransportError:
+        pass
+    return True
+
+def _cuerpo_solicitud(raw: bytes, usar_gzip: bool) -> tuple[bytes, Dict[str, str]]:
+    """Cuerpo y cabeceras para enviar la solicitud, comprimida con gzip si se pide."""
+    if usar_gzip:
+        return gzip.compress(raw, compresslevel=3), JSON_GZIP_HEADERS
+    return raw, JSON_HEADERS
+
+def validar_solicitud_remota(session: httpx.Client, base_url: str, json_file_path: str, verbose: bool = False, raw_response: bool = False, usar_gzip: bool = False) -> bool:
+    """
+    Carga y valida una solicitud contra el endpoint /validate.
+    Retorna True si es válida, False en caso contrario.
+    """
+    import httpx
+
+    # --- 1. Cargar la solicitud desde el archivo JSON ---
+    cargada = cargar_solicitud(json_file_path, verbose)
+    if cargada is None:
         return False
+    _, raw = cargada
 
     # --- 2. Validar la solicitud ---
     print_separator("Validando la solicitud contra el servidor")
     try:
         validate_url = f"{base_url}/validate"
-        response = session.post(validate_url, json=request_data)
-        print_response(response)
+        body, headers = _cuerpo_solicitud(raw, usar_gzip)
+        response = session.post(validate_url, content=body, headers=headers)
+        print_response(response, raw_response)
         return response.status_code == 200
-    except requests.ConnectionError:
+    except httpx.TransportError:
         print(f"❌ Error de conexión: No se pudo conectar a {base_url}. ¿Está el servidor corriendo?")
         return False
 
-def iniciar_nueva_consulta(session: requests.Session, base_url: str, json_file_path: str) -> str | None:
+def iniciar_nueva_consulta(session: httpx.Client, base_url: str, json_file_path: str, verbose: bool = False, raw_response: bool = False, usar_gzip: bool = False) -> str | None:
     """
     Carga, valida y crea una nueva consulta, devolviendo su ID.
     Retorna el ID de la consulta o None si falla.
     """
+    import httpx
+
     # --- 1. Cargar la solicitud desde el archivo JSON ---
-    print_separator(f"Cargando solicitud desde {json_file_path}")
-    try:
-        with open(json_file_path, 'r') as f:
-            request_data = json.load(f)
-        print("Solicitud cargada exitosamente.")
-        print(json.dumps(request_data, indent=2, ensure_ascii=False))
-    except FileNotFoundError:
-        print(f"❌ Error: El archivo '{json_file_path}' no fue encontrado.")
-        return None
-    except json.JSONDecodeError:
-        print(f"❌ Error: El archivo '{json_file_path}' no contiene un JSON válido.")
+    cargada = cargar_solicitud(json_file_path, verbose)
+    if cargada is None:
         return None
+    _, raw = cargada
 
-    # --- 2. Validar la solicitud ---
-    print_separator("Paso 1: Validando la solicitud")
+    # --- 2. Validar y crear la consulta en una sola llamada ---
+    print_separator("Paso 1: Validando y creando la consulta")
     try:
-        validate_url = f"{base_url}/validate"
-        response = session.post(validate_url, json=request_data)
-        print_response(response)
+        query_url = f"{base_url}/query?validate=1"
+        body, headers = _cuerpo_solicitud(raw, usar_gzip)
+        response = session.post(query_url, content=body, headers=headers)
+        print_response(response, raw_response)
         if response.status_code != 200:
-            print("\n❌ La validación falló. Abortando.")
+            print("\n❌ La validación o creación de la consulta falló. Abortando.")
             return None
-    except requests.ConnectionError:
+    except httpx.TransportError:
         print(f"❌ Error de conexión: No se pudo conectar a {base_url}. ¿Está el servidor corriendo?")
         return None
-
-    # --- 3. Crear la consulta ---
-    print_separator("Paso 2: Creando la consulta")
-    query_url = f"{base_url}/query"
-    response = session.post(query_url, json=request_data)
-    print_response(response)
-    if response.status_code != 200:
-        print("\n❌ La creación de la consulta falló. Abortando.")
-        return None
     
-    consulta_id = response.json().get("consulta_id")
+    consulta_id = _json(response).get("consulta_id")
     if not consulta_id:
         print("\n❌ No se recibió un ID de consulta. Abortando.")
         return None
-    
+
+    try:
+        ARCHIVO_ULTIMA_CONSULTA.write_text(consulta_id)
+    except OSError as e:
+        print(f"⚠️  No se pudo guardar el ID de la consulta en '{ARCHIVO_ULTIMA_CONSULTA}': {e}")
+
     return consulta_id
 
-def monitorear_consulta(session: requests.Session, base_url: str, consulta_id: str, timeout: int, poll_interval: int):
+def _intervalo_por_progreso(primer_progreso: tuple[float, float], progreso: float, poll_interval: int) -> float | None:
+    """
+    Estima el siguiente intervalo de sondeo a partir del ritmo de avance observado:
+    la mitad del tiempo restante estimado, acotado a [0.5, poll_interval].
+    Retorna None si aún no se ha observado avance.
+    """
+    t0, p0 = primer_progreso
+    if progreso <= p0:
+        return None
+    ritmo = (progreso - p0) / max(time.monotonic() - t0, 1e-3)
+    eta = (100 - progreso) / ritmo
+    return min(max(eta * 0.5, 0.5), poll_interval)
+
+def _esperar_eventos_sse(session: httpx.Client, events_url: str, deadline: float) -> tuple[bool, str | None]:
+    """
+    Sigue el stream SSE de la consulta imprimiendo cada cambio de estado.
+    Retorna (usar_sondeo, estado_final): `usar_sondeo` es True si el stream no está
+    disponible o se cortó antes del evento final, para continuar con sondeo periódico.
+    """
+    import httpx
+
+    try:
+        with session.stream(
+            "GET",
+            events_url,
+            headers={"Accept": "text/event-stream"},
+            timeout=httpx.Timeout(SSE_READ_TIMEOUT, connect=5),
+        ) as response:
+            if response.status_code != 200:
+                print(f"-> SSE no disponible ({response.status_code}); se usa sondeo periódico.")
+                return True, None
+            evento = None
+            for linea in response.iter_lines():
+                if time.monotonic() >= deadline:
+                    return False, None
+                if linea.startswith("event:"):
+                    evento = linea[len("event:"):].strip()
+                elif linea.startswith("data:"):
+                    data = _loads(linea[len("data:"):].strip())
+                    if evento == "error":
+                        print(f"-> El stream terminó con error: {data.get('detail')}")
+                        return False, "error"
+                    estado = data.get("estado")
+                    print(f"-> Estado: {estado} | Progreso: {data.get('progreso')}% | Mensaje: {data.get('mensaje')}")
+                    if evento == "completed":
+                        return False, estado
+                elif not linea:
+                    evento = None
+    except httpx.TransportError as e:
+        print(f"-> Stream SSE interrumpido ({e}); se continúa con sondeo periódico.")
+    return True, None
+
+def _pausa_long_poll(inicio_sondeo: float, long_poll_wait: int, poll_interval: int, deadline: float):
+    """
+    Si un sondeo largo volvió antes de la mitad de `long_poll_wait` sin cambios (un
+    servidor antiguo o un proxy que descarta `wait`), espera `poll_interval` antes
+    del siguiente, para no repetir GETs sin pausa hasta el deadline.
+    """
+    if time.monotonic() - inicio_sondeo < long_poll_wait / 2:
+        time.sleep(max(0.0, min(poll_interval, deadline - time.monotonic())))
+
+def monitorear_consulta(session: httpx.Client, base_url: str, consulta_id: str, timeout: int, poll_interval: int, long_poll_wait: int = 0, raw_response: bool = False, sse: bool = False):
     """
     Monitorea el estado de una consulta hasta que se complete, falle o se agote el tiempo.
+    Si `long_poll_wait` > 0, el servidor retiene cada sondeo hasta que cambie el estado
+    (o pasen `long_poll_wait` segundos) en lugar de esperar localmente entre sondeos.
+    Con `sse`, sigue el stream /query/{id}/events y solo recurre al sondeo si no está disponible.
     """
-    query_status_url = f"{base_url}/query/{consulta_id}"
-    print_separator(f"Paso 3: Monitoreando la consulta '{consulta_id}'")
-    start_time = time.time()
+    import httpx
+
+    status_url = f"{base_url}/query/{consulta_id}"
+    results_url = f"{status_url}?resultados=True"
+    print_separator(f"Paso 2: Monitoreando la consulta '{consulta_id}'")
+    deadline = time.monotonic() + timeout
     final_status = None
+    usar_sondeo = True
+    if sse:
+        usar_sondeo, final_status = _esperar_eventos_sse(session, f"{status_url}/events", deadline)
 
-    while time.time() - start_time < timeout:
-        response = session.get(query_status_url)
+    # El intervalo arranca corto y se duplica (hasta poll_interval) cuando el
+    # servidor responde con error o el progreso no avanza entre sondeos.
+    delay = 1.0
+    ultimo_progreso = None
+    sondeos_sin_avance = 0
+    ultimo_estado_impreso = None
+    puntos_pendientes = False
+    primer_progreso = None  # (instante, progreso) del primer sondeo con progreso numérico
+    while usar_sondeo and time.monotonic() < deadline:
+        inicio_sondeo = time.monotonic()
+        if long_poll_wait > 0:
+            try:
+                response = session.get(
+                    status_url,
+                    params={"wait": long_poll_wait},
+                    timeout=httpx.Timeout(long_poll_wait + 5, connect=5),
+                )
+            except httpx.TimeoutException:
+                _pausa_long_poll(inicio_sondeo, long_poll_wait, poll_interval, deadline)
+                continue
+        else:
+            response = session.get(status_url)
         if response.status_code == 200:
-            data = response.json()
+            data = _json(response)
             estado = data.get("estado")
             progreso = data.get("progreso")
             mensaje = data.get("mensaje")
-            print(f"-> Estado: {estado} | Progreso: {progreso}% | Mensaje: {mensaje}")
+            clave_estado = (estado, progreso)
+            cambio = clave_estado != ultimo_estado_impreso
+            if cambio:
+                if puntos_pendientes:
+                    print()
+                    puntos_pendientes = False
+                print(f"-> Estado: {estado} | Progreso: {progreso}% | Mensaje: {mensaje}")
+                ultimo_estado_impreso = clave_estado
+            else:
+                # Sin cambios: solo un punto para indicar que el monitoreo sigue vivo.
+                print(".", end="", flush=True)
+                puntos_pendientes = True
             if estado in ["completado", "error"]:
                 final_status = estado
                 break
+            if long_poll_wait > 0:
+                # El servidor ya esperó el cambio de estado; volver a sondear de inmediato,
+                # salvo que haya respondido sin cambios mucho antes del plazo.
+                if not cambio:
+                    _pausa_long_poll(inicio_sondeo, long_poll_wait, poll_interval, deadline)
+                continue
+            if progreso != ultimo_progreso:
+                ultimo_progreso = progreso
+                sondeos_sin_avance = 0
+                delay = 1.0
+            else:
+                sondeos_sin_avance += 1
+                if sondeos_sin_avance >= MAX_SONDEOS_SIN_AVANCE:
+                    delay = min(delay * 2, poll_interval)
+            if not isinstance(progreso, (int, float)):
+                delay = poll_interval
+            else:
+                if primer_progreso is None:
+                    primer_progreso = (time.monotonic(), progreso)
+                estimado = _intervalo_por_progreso(primer_progreso, progreso, poll_interval)
+                if estimado is not None and sondeos_sin_avance < MAX_SONDEOS_SIN_AVANCE:
+                    delay = estimado
         else:
+            if puntos_pendientes:
+                print()
+                puntos_pendientes = False
             print(f"-> Error al obtener estado: {response.status_code}")
-        time.sleep(poll_interval)
+            delay = min(delay * 2, poll_interval)
+        time.sleep(delay + random.uniform(0, delay * 0.25))
 
     if not final_status:
         print("\n⏰ Timeout esperando la finalización de la consulta.")
@@ -126,12 +524,93 @@ def monitorear_consulta(session: requests.Session, base_url: str, consulta_id: s
 
     # --- Obtener los resultados finales ---
     if final_status == "completado":
-        print_separator("Paso 4: Obteniendo resultados finales")
-        response = session.get(query_status_url, params={"resultados": "True"})
-        print_response(response)
+        print_separator("Paso 3: Obteniendo resultados finales")
+        imprimir_resultados(session, results_url, raw_response)
     else:
         print_separator("Consulta finalizada con error")
         print("No se pueden obtener resultados.")
+
+
+async def _crear_consulta_lote(client: httpx.AsyncClient, query_url: str, raw: bytes, usar_gzip: bool) -> tuple[str | None, str]:
+    """Envía el contenido de un archivo del lote a /query. Retorna (consulta_id, descripción del estado)."""
+    import httpx
+
+    body, headers = _cuerpo_solicitud(raw, usar_gzip)
+    try:
+        response = await client.post(query_url, content=body, headers=headers)
+    except httpx.TransportError as e:
+        return None, f"❌ error de conexión: {e}"
+    if response.status_code != 200:
+        return None, f"❌ HTTP {response.status_code}: {response.text[:120]}"
+    consulta_id = _json(response).get("consulta_id")
+    if not consulta_id:
+        return None, "❌ no se recibió un ID de consulta"
+    return consulta_id, "recibido"
+
+def _imprimir_tabla_lote(lineas: Dict[str, str], redibujar: bool):
+    """Imprime una línea por archivo del lote; en una terminal la tabla se reescribe en el mismo lugar."""
+    if redibujar:
+        sys.stdout.write(f"\x1b[{len(lineas)}F")
+    for nombre, linea in lineas.items():
+        sys.stdout.write(f"\x1b[2K{nombre}: {linea}\n" if sys.stdout.isatty() else f"{nombre}: {linea}\n")
+    sys.stdout.flush()
+
+async def _monitorear_lote(base_url: str, directorio: str, timeout: int, poll_interval: int, usar_gzip: bool = False):
+    """Envía en paralelo los .json de `directorio` y monitorea sus consultas hasta que terminen o se agote `timeout`."""
+    import asyncio
+
+    rutas = sorted(Path(directorio).glob("*.json"))
+    if not rutas:
+        print(f"❌ Error: No se encontraron archivos .json en '{directorio}'.")
+        return
+
+    # Los archivos se leen antes de crear las consultas: la lectura es síncrona
+    # y dentro de las corrutinas bloquearía el event loop.
+    lineas = {}
+    cuerpos = {}
+    for ruta in rutas:
+        try:
+            cuerpos[ruta.name] = ruta.read_bytes()
+        except OSError as e:
+            lineas[ruta.name] = f"❌ no se pudo leer el archivo: {e}"
+
+    deadline = time.monotonic() + timeout
+    query_url = f"{base_url}/query"
+    async with crear_sesion_async(base_url) as client:
+        print_separator(f"Creando {len(cuerpos)} consultas desde {directorio}")
+        creadas = await asyncio.gather(*(_crear_consulta_lote(client, query_url, raw, usar_gzip) for raw in cuerpos.values()))
+        lineas.update((nombre, descripcion) for nombre, (_, descripcion) in zip(cuerpos, creadas))
+        lineas = {ruta.name: lineas[ruta.name] for ruta in rutas}
+        pendientes = {nombre: consulta_id for nombre, (consulta_id, _) in zip(cuerpos, creadas) if consulta_id}
+
+        print_separator("Monitoreando el lote")
+        redibujar = False
+        while pendientes and time.monotonic() < deadline:
+            items = list(pendientes.items())
+            respuestas = await asyncio.gather(
+                *(client.get(f"{base_url}/query/{consulta_id}") for _, consulta_id in items),
+                return_exceptions=True,
+            )
+            for (nombre, consulta_id), response in zip(items, respuestas):
+                if isinstance(response, Exception):
+                    lineas[nombre] = f"[{consulta_id}] error al obtener estado: {response}"
+                    continue
+                if response.status_code != 200:
+                    lineas[nombre] = f"[{consulta_id}] error al obtener estado: {response.status_code}"
+                    continue
+                data = _json(response)
+                estado = data.get("estado")
+                lineas[nombre] = f"[{consulta_id}] {estado} | {data.get('progreso')}% | {data.get('mensaje')}"
+                if estado in ("completado", "error"):
+                    del pendientes[nombre]
+            _imprimir_tabla_lote(lineas, redibujar and sys.stdout.isatty())
+            redibujar = True
+            if pendientes:
+                await asyncio.sleep(poll_interval)
+
+    if pendientes:
+        print(f"\n⏰ Timeout esperando la finalización de {len(pendientes)} consultas del lote.")
+
 def main(
     base_url: str,
     json_file_path: str,
@@ -139,103 +618,77 @@ def main(
     poll_interval: int,
     resume_id: str = None,
     validate_only: bool = False,
+    long_poll_wait: int = 0,
+    verbose: bool = False,
+    batch_dir: str = None,
+    raw_response: bool = False,
+    reuse_last: bool = False,
+    sse: bool = False,
+    usar_gzip: bool = False,
 ):
     """
     Función principal que envía una solicitud desde un archivo JSON y monitorea el resultado.
+    Con `batch_dir`, envía todos los .json del directorio y los monitorea en conjunto.
     """
     print(f"🎯 Apuntando al servidor en: {base_url}")
 
+    if batch_dir:
+        import asyncio
+        asyncio.run(_monitorear_lote(base_url, batch_dir, timeout, poll_interval, usar_gzip))
+        return
+
     if validate_only:
         if not json_file_path:
             print("❌ Error: Se debe proporcionar un archivo JSON para validar.")
             return
     
-    with requests.Session() as session:
+    if not resume_id and reuse_last:
+        try:
+            resume_id = ARCHIVO_ULTIMA_CONSULTA.read_text().strip() or None
+        except FileNotFoundError:
+            print(f"❌ Error: No existe '{ARCHIVO_ULTIMA_CONSULTA}'; no hay una consulta previa que reanudar.")
+            return
+
+    with crear_sesion(base_url) as session:
         consulta_id = None
         if resume_id:
             print_separator(f"Reanudando monitoreo para la consulta '{resume_id}'")
             consulta_id = resume_id
         else:
+            if (validate_only or json_file_path) and not servidor_disponible(session, base_url):
+                return
             if validate_only:
-                validar_solicitud_remota(session, base_url, json_file_path)
+                validar_solicitud_remota(session, base_url, json_file_path, verbose, raw_response, usar_gzip)
                 return
             if not json_file_path:
                 print("❌ Error: Se debe proporcionar un archivo JSON si no se está reanudando una consulta.")
                 return
             
-            consulta_id = iniciar_nueva_consulta(session, base_url, json_file_path)
+            consulta_id = iniciar_nueva_consulta(session, base_url, json_file_path, verbose, raw_response, usar_gzip)
 
         if consulta_id:
-            monitorear_consulta(session, base_url, consulta_id, timeout, poll_interval)
-
-def test_query_local_success(monkeypatch):
-    """Simula recuperación exitosa solo desde Lustre/local."""
-    monkeypatch.setattr("recover.LustreRecoverFiles.discover_and_filter_files", lambda self, q: [Path("/tmp/fake1.tgz")])
-    monkeypatch.setattr("recover.LustreRecoverFiles.scan_existing_files", lambda self, files, dest: files)
-    monkeypatch.setattr("recover._process_safe_recover_file", lambda *a, **kw: [Path("/tmp/fake1.tgz")])
-    monkeypatch.setattr("recover.S3RecoverFiles.discover_files", lambda *a, **kw: {})
-    monkeypatch.setattr("recover.S3RecoverFiles.download_files", lambda *a, **kw: ([], []))
-
-    response = client.post("/query", json=VALID_REQUEST)
-    assert response.status_code == 200
-    consulta_id = response.json()["consulta_id"]
-
-    # Polling hasta completado
-    for _ in range(10):
-        status = client.get(f"/query/{consulta_id}")
-        if status.json()["estado"] == "completado":
-            break
-        time.sleep(0.1)
-    assert status.json()["estado"] == "completado"
-
-def test_query_s3_success(monkeypatch):
-    """Simula recuperación exitosa solo desde S3."""
-    monkeypatch.setattr("recover.LustreRecoverFiles.discover_and_filter_files", lambda self, q: [])
-    monkeypatch.setattr("recover.S3RecoverFiles.discover_files", lambda self, q, d: {"fake2.tgz": "s3://bucket/fake2.tgz"})
-    monkeypatch.setattr("recover.S3RecoverFiles.filter_files_by_time", lambda self, files, f, h: files)
-    monkeypatch.setattr("recover.S3RecoverFiles.download_files", lambda self, cid, files, dest, db: ([Path("/tmp/fake2.tgz")], []))
-
-    response = client.post("/query", json=VALID_REQUEST)
-    assert response.status_code == 200
-    consulta_id = response.json()["consulta_id"]
-
-    for _ in range(10):
-        status = client.get(f"/query/{consulta_id}")
-        if status.json()["estado"] == "completado":
-            break
-        time.sleep(0.1)
-    assert status.json()["estado"] == "completado"
-
-def test_query_local_and_s3_fallback(monkeypatch):
-    """Simula recuperación mixta: algunos archivos locales, otros desde S3."""
-    # Un archivo local, uno solo en S3
-    monkeypatch.setattr("recover.LustreRecoverFiles.discover_and_filter_files", lambda self, q: [Path("/tmp/fake1.tgz"), Path("/tmp/fake2.tgz")])
-    monkeypatch.setattr("recover.LustreRecoverFiles.scan_existing_files", lambda self, files, dest: [Path("/tmp/fake1.tgz")])
-    monkeypatch.setattr("recover._process_safe_recover_file", lambda *a, **kw: [Path("/tmp/fake1.tgz")])
-    monkeypatch.setattr("recover.S3RecoverFiles.discover_files", lambda self, q, d: {"fake2.tgz": "s3://bucket/fake2.tgz"})
-    monkeypatch.setattr("recover.S3RecoverFiles.filter_files_by_time", lambda self, files, f, h: files)
-    monkeypatch.setattr("recover.S3RecoverFiles.download_files", lambda self, cid, files, dest, db: ([Path("/tmp/fake2.tgz")], []))
-
-    response = client.post("/query", json=VALID_REQUEST)
-    assert response.status_code == 200
-    consulta_id = response.json()["consulta_id"]
-
-    for _ in range(10):
-        status = client.get(f"/query/{consulta_id}")
-        if status.json()["estado"] == "completado":
-            break
-        time.sleep(0.1)
-    assert status.json()["estado"] == "completado"
+            try:
+                monitorear_consulta(session, base_url, consulta_id, timeout, poll_interval, long_poll_wait, raw_response, sse)
+            except KeyboardInterrupt:
+                print("\n\n⏹️  Monitoreo interrumpido. La consulta sigue en el servidor; para reanudar:")
+                print(f"   python api_client.py {base_url} --resume {consulta_id}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Cliente para la API de solicitudes históricas.")
     parser.add_argument("base_url", help="URL base de la API (ej. http://localhost:9041).")
     parser.add_argument("json_file", nargs='?', default=None, help="Ruta al archivo JSON de la solicitud (requerido si no se usa --resume).")
     parser.add_argument("--resume", type=str, default=None, help="ID de una consulta existente para reanudar el monitoreo.")
+    parser.add_argument("--reuse-last", action="store_true", help=f"Reanuda el monitoreo de la última consulta creada (guardada en {ARCHIVO_ULTIMA_CONSULTA}).")
     parser.add_argument("--validate", action="store_true", help="Solo valida el archivo JSON contra el endpoint /validate y sale.")
     parser.add_argument("--timeout", type=int, default=600, help="Tiempo máximo de espera en segundos para la consulta.")
     parser.add_argument("--poll-interval", type=int, default=10, help="Intervalo en segundos entre cada sondeo de estado.")
+    parser.add_argument("--batch", type=str, default=None, metavar="DIR", help="Envía todos los archivos .json de DIR en paralelo y monitorea sus consultas en conjunto.")
+    parser.add_argument("--gzip", action="store_true", help="Envía el cuerpo de la solicitud comprimido con gzip (requiere un servidor que lo soporte).")
+    parser.add_argument("--sse", action="store_true", help="Sigue los cambios de estado por Server-Sent Events (/query/{id}/events) en lugar de sondear.")
+    parser.add_argument("--raw-response", action="store_true", help="Imprime las respuestas del servidor tal cual, sin reformatear el JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Imprime completo el JSON de la solicitud cargada.")
+    parser.add_argument("--long-poll", type=int, nargs='?', const=30, default=0, metavar="SEGUNDOS", help="Usa long polling: el servidor retiene cada sondeo hasta que cambie el estado (por defecto 30s).")
 
     args = parser.parse_args()
 
-    main(args.base_url, args.json_file, args.timeout, args.poll_interval, args.resume, args.validate)
\ No newline at end of file
+    main(args.base_url, args.json_file, args.timeout, args.poll_interval, args.resume, args.validate, args.long_poll, args.verbose, args.batch, args.raw_response, args.reuse_last, args.sse, args.gzip)
\ No newline at end of file
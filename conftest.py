@@ -0,0 +1,25 @@
+from concurrent.futures import Future
+
+import pytest
+
+
+class _ExecutorInmediato:
+    """Executor mínimo estilo pebble: ejecuta cada tarea al agendarla y registra sus argumentos."""
+
+    def __init__(self):
+        self.tareas = []
+
+    def schedule(self, fn, args=(), kwargs=None, timeout=None):
+        self.tareas.append(args)
+        future = Future()
+        try:
+            future.set_result(fn(*args, **(kwargs or {})))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@pytest.fixture
+def executor_inmediato():
+    """Executor que corre las tareas en el hilo de la prueba, sin pools ni procesos."""
+    return _ExecutorInmediato()
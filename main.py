@@ -1,4 +1,7 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.gzip import GZipMiddleware
 from database import ConsultasDatabase, DATABASE_PATH
 from background_simulator import BackgroundSimulator
 from recover import RecoverFiles # Importar el procesador real
@@ -7,6 +10,9 @@ from schemas import HistoricQueryRequest
 from datetime import datetime
 from typing import Dict, Any
 import re
+import zlib
+import json
+import asyncio
 from contextlib import asynccontextmanager
 import logging
 from pydantic import ValidationError
@@ -15,7 +21,7 @@ import uvicorn
 import os
 import secrets
 import string
-from pebble import ProcessPool
+from pebble import ProcessPool, ThreadPool
 
 # --- Configuración de Logging ---
 # Configura el logging para escribir en un archivo en un entorno de producción.
@@ -42,14 +48,119 @@ async def lifespan(app: FastAPI):
     logging.info("   Esperando a que las tareas de fondo se completen...")
     executor.close()
     executor.join()
+    if cpu_executor is not None:
+        cpu_executor.close()
+        cpu_executor.join()
     logging.info("✅ Todas las tareas de fondo han finalizado. Servidor apagado.")
 
+# Límites para cuerpos gzip: unos KB comprimidos pueden inflarse a GB (bomba de
+# descompresión), así que se acota tanto lo recibido como lo descomprimido.
+MAX_GZIP_BODY_BYTES = int(os.getenv("MAX_GZIP_BODY_BYTES", str(10 * 1024 * 1024)))
+MAX_DECOMPRESSED_BODY_BYTES = int(os.getenv("MAX_DECOMPRESSED_BODY_BYTES", str(50 * 1024 * 1024)))
+
+
+class _CuerpoDemasiadoGrande(Exception):
+    """El cuerpo recibido o descomprimido excede el límite configurado."""
+
+
+def _inflar_gzip(descompresor, datos: bytes, salida: bytearray):
+    """
+    Descomprime 'datos' en 'salida' sin pasar de MAX_DECOMPRESSED_BODY_BYTES.
+    Admite varios miembros gzip concatenados; devuelve el descompresor en uso.
+    """
+    while datos:
+        salida += descompresor.decompress(datos, MAX_DECOMPRESSED_BODY_BYTES - len(salida) + 1)
+        if len(salida) > MAX_DECOMPRESSED_BODY_BYTES:
+            raise _CuerpoDemasiadoGrande()
+        if descompresor.eof and descompresor.unused_data:
+            datos = descompresor.unused_data
+            descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            datos = b""
+    return descompresor
+
+
+class GZipSalvoEventosMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware que deja pasar sin comprimir los streams SSE (/query/{id}/events):
+    comprimirlos retendría los eventos en el búfer de gzip. Se excluye la ruta en lugar
+    de depender de que la versión instalada de starlette omita text/event-stream.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/events"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+class GzipRequestMiddleware:
+    """
+    Middleware ASGI que descomprime los cuerpos de solicitud enviados con
+    `Content-Encoding: gzip` antes de que lleguen a los endpoints. Responde 413
+    si el cuerpo excede MAX_GZIP_BODY_BYTES (comprimido) o
+    MAX_DECOMPRESSED_BODY_BYTES (descomprimido), y 400 si el gzip es inválido.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (b"content-encoding", b"gzip") not in [
+            (k, v.lower()) for k, v in scope["headers"]
+        ]:
+            await self.app(scope, receive, send)
+            return
+
+        # Se descomprime a medida que llegan los fragmentos, sin acumular el cuerpo comprimido
+        body = bytearray()
+        recibidos = 0
+        descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                fragmento = message.get("body", b"")
+                recibidos += len(fragmento)
+                if recibidos > MAX_GZIP_BODY_BYTES:
+                    raise _CuerpoDemasiadoGrande()
+                descompresor = _inflar_gzip(descompresor, fragmento, body)
+                more_body = message.get("more_body", False)
+            if recibidos and not descompresor.eof:
+                raise zlib.error("gzip truncado")
+        except _CuerpoDemasiadoGrande:
+            response = JSONResponse({"detail": "Cuerpo de la solicitud demasiado grande."}, status_code=413)
+            await response(scope, receive, send)
+            return
+        except zlib.error:
+            response = JSONResponse({"detail": "Cuerpo gzip inválido."}, status_code=400)
+            await response(scope, receive, send)
+            return
+
+        body = bytes(body)
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        entregado = False
+
+        async def receive_descomprimido():
+            nonlocal entregado
+            if not entregado:
+                entregado = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(dict(scope, headers=headers), receive_descomprimido, send)
+
 app = FastAPI(
     title="LANOT Historic Server",
     description="API para solicitudes de datos históricos del LANOT",
     version="1.0.0",
     lifespan=lifespan
 )
+# Respuestas comprimidas para clientes que envían Accept-Encoding: gzip
+# (p. ej. listas grandes de resultados) y solicitudes comprimidas con --gzip.
+app.add_middleware(GZipSalvoEventosMiddleware, minimum_size=1024, compresslevel=5)
+app.add_middleware(GzipRequestMiddleware)
 
 # Registro de configuraciones de satélites disponibles
 # A medida que agregues soporte para más satélites, importa su config y añádela aquí.
@@ -67,9 +178,16 @@ DOWNLOAD_PATH = os.getenv("HISTORIC_DOWNLOAD_PATH", "/data/tmp")
 # Selección del procesador de background mediante variable de entorno
 PROCESSOR_MODE = os.getenv("PROCESSOR_MODE", "real") # 'real' o 'simulador'
 
-# Crear un único ThreadPoolExecutor para toda la aplicación
+# Crear un único pool para toda la aplicación. El trabajo por archivo es E/S
+# (lectura, gzip en zlib y escritura liberan el GIL), por lo que por defecto se usan
+# hilos; 'process' aísla cada archivo en un subproceso y permite cortar por timeout.
 MAX_WORKERS = int(os.getenv("HISTORIC_MAX_WORKERS", "8"))
-executor = ProcessPool(max_workers=MAX_WORKERS)
+EXECUTOR_MODE = os.getenv("HISTORIC_EXECUTOR", "thread").lower()
+executor = ProcessPool(max_workers=MAX_WORKERS) if EXECUTOR_MODE == "process" else ThreadPool(max_workers=MAX_WORKERS)
+# Pool de procesos opcional solo para la extracción selectiva (descompresión gzip, CPU).
+# 0 = desactivado: todo corre en el executor anterior.
+CPU_WORKERS = int(os.getenv("HISTORIC_CPU_WORKERS", "0"))
+cpu_executor = ProcessPool(max_workers=CPU_WORKERS) if CPU_WORKERS > 0 else None
 
 # Inicializar componentes
 db = ConsultasDatabase(db_path=DB_PATH)
@@ -85,6 +203,7 @@ if PROCESSOR_MODE == "real":
         source_data_path=SOURCE_DATA_PATH,
         base_download_path=DOWNLOAD_PATH,
         executor=executor,
+        cpu_executor=cpu_executor,
         s3_fallback_enabled=os.getenv("S3_FALLBACK_ENABLED", "1") not in ("0","false","False"),
         lustre_enabled=os.getenv("LUSTRE_ENABLED", "1") not in ("0","false","False")
     )
@@ -92,6 +211,13 @@ else:
     recover = BackgroundSimulator(db)
 
 
+# Long polling: tiempo máximo que GET /query/{id}?wait=N retiene la conexión
+# y cada cuánto se revisa la DB en busca de un cambio de estado.
+MAX_LONG_POLL_SECONDS = int(os.getenv("MAX_LONG_POLL_SECONDS", "60"))
+LONG_POLL_TICK_SECONDS = 0.5
+# SSE: cada cuánto se envía un comentario para mantener viva la conexión.
+SSE_HEARTBEAT_SECONDS = 15
+
 def generar_id_consulta() -> str:
     return ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(8))
 
@@ -184,13 +310,28 @@ def _validate_and_prepare_request(request_data: Dict[str, Any]) -> (Dict[str, An
 
     return data, config
 
+def _resumen_validacion(data: Dict[str, Any], config: Any, query_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumen de una solicitud ya validada, tal como lo devuelve /validate."""
+    return {
+        "satelite": query_dict['satelite'],
+        "sensor": query_dict['sensor'],
+        "nivel": query_dict['nivel'],
+        "total_fechas_expandidas": query_dict['total_fechas_expandidas'],
+        "total_horas": query_dict['total_horas'],
+        "bandas_procesadas": query_dict['bandas'],
+        "archivos_estimados": config.estimate_file_count(data)
+    }
+
 @app.post("/query")
 async def crear_solicitud(
     background_tasks: BackgroundTasks,
     request_data: Dict[str, Any] = Body(...),
+    validate: bool = False,
 ):
     """
     ✅ ENDPOINT PRINCIPAL: Crear y procesar solicitud
+    Con `validate=1` la respuesta incluye también el resumen de validación
+    (el mismo de /validate), evitando una llamada previa a ese endpoint.
     """
     try:
         # 1. Validar y preparar la solicitud usando la función de ayuda
@@ -207,7 +348,7 @@ async def crear_solicitud(
         # Procesar en background
         background_tasks.add_task(recover.procesar_consulta, consulta_id, query_dict)
         
-        return {
+        respuesta = {
             "success": True,
             "consulta_id": consulta_id,
             "estado": "recibido",
@@ -219,6 +360,13 @@ async def crear_solicitud(
                 "horas": query_dict['total_horas']
             }
         }
+        if validate:
+            respuesta["validation"] = {
+                "success": True,
+                "message": "La solicitud es válida.",
+                "resumen_solicitud": _resumen_validacion(data, config, query_dict)
+            }
+        return respuesta
         
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -237,21 +385,11 @@ async def validar_solicitud(request_data: Dict[str, Any] = Body(...)):
         query_obj = processor.procesar_request(data, config)
         query_dict = query_obj.to_dict() # Mantenemos to_dict si es un método custom de la dataclass
 
-        # 3. Estimar la cantidad de archivos usando el método de la config
-        file_estimate = config.estimate_file_count(data)
-
+        # 3. Resumen con la estimación de archivos de la config
         return {
             "success": True,
             "message": "La solicitud es válida.",
-            "resumen_solicitud": {
-                "satelite": query_dict['satelite'],
-                "sensor": query_dict['sensor'],
-                "nivel": query_dict['nivel'],
-                "total_fechas_expandidas": query_dict['total_fechas_expandidas'],
-                "total_horas": query_dict['total_horas'],
-                "bandas_procesadas": query_dict['bandas'],
-                "archivos_estimados": file_estimate
-            }
+            "resumen_solicitud": _resumen_validacion(data, config, query_dict)
         }
     except ValueError as e:
         # Convertir errores de validación de lógica de negocio en 400
@@ -287,19 +425,45 @@ async def reiniciar_consulta(consulta_id: str, background_tasks: BackgroundTasks
         "message": f"La consulta '{consulta_id}' ha sido reenviada para su procesamiento."
     }
 
+def _firma_estado(consulta: Dict[str, Any]) -> tuple:
+    return (consulta["estado"], consulta["progreso"], consulta["mensaje"])
+
+async def _esperar_cambio_estado(consulta_id: str, consulta: Dict[str, Any], wait: float) -> Dict[str, Any]:
+    """Espera hasta `wait` segundos a que la consulta cambie; devuelve su versión más reciente."""
+    firma_inicial = _firma_estado(consulta)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while loop.time() < deadline:
+        await asyncio.sleep(min(LONG_POLL_TICK_SECONDS, max(0.0, deadline - loop.time())))
+        # sqlite es síncrono: leer en un hilo para no frenar el event loop con cada cliente en espera
+        actual = await run_in_threadpool(db.obtener_consulta, consulta_id)
+        if not actual:
+            break
+        consulta = actual
+        if _firma_estado(consulta) != firma_inicial:
+            break
+    return consulta
+
 @app.get("/query/{consulta_id}")
 async def obtener_consulta(
     consulta_id: str,
     resultados: bool = False,
     detalles: bool = False,
+    wait: int = 0,
 ):
     """
     ✅ ENDPOINT ÚNICO PARA CONSULTAR: Estado y resultados
     Reemplaza a: /api/query/{id}, /api/query/{id}/resultados, /api/queries
+
+    Con `wait=N` (long polling) la respuesta se retiene hasta que cambie el
+    estado, progreso o mensaje de la consulta, o hasta que pasen N segundos.
     """
     consulta = db.obtener_consulta(consulta_id)
     if not consulta:
         raise HTTPException(status_code=404, detail="Consulta no encontrada")
+
+    if wait > 0 and consulta["estado"] not in ("completado", "error"):
+        consulta = await _esperar_cambio_estado(consulta_id, consulta, min(wait, MAX_LONG_POLL_SECONDS))
     
     # Si se piden resultados específicos y la consulta está completada
     if resultados and consulta["estado"] == "completado" and consulta.get("resultados"):
@@ -380,6 +544,55 @@ async def obtener_consulta(
             pass
     return resp
 
+def _evento_sse(evento: str, consulta_id: str, consulta: Dict[str, Any]) -> str:
+    data = {
+        "consulta_id": consulta_id,
+        "estado": consulta["estado"],
+        "progreso": consulta["progreso"],
+        "mensaje": consulta["mensaje"],
+        "timestamp": consulta["timestamp_actualizacion"],
+    }
+    return f"event: {evento}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/query/{consulta_id}/events")
+async def eventos_consulta(consulta_id: str):
+    """
+    ✅ STREAM DE EVENTOS (SSE): Emite un evento `estado` cada vez que cambia el
+    estado, progreso o mensaje de la consulta, y un evento final `completed`
+    (con estado 'completado' o 'error') antes de cerrar el stream. Si la consulta
+    se elimina mientras tanto, el stream termina con un evento `error`.
+    """
+    consulta = db.obtener_consulta(consulta_id)
+    if not consulta:
+        raise HTTPException(status_code=404, detail="Consulta no encontrada")
+
+    async def generar_eventos():
+        actual = consulta
+        ultima_firma = None
+        ultimo_envio = asyncio.get_running_loop().time()
+        while True:
+            firma = _firma_estado(actual)
+            if actual["estado"] in ("completado", "error"):
+                yield _evento_sse("completed", consulta_id, actual)
+                return
+            ahora = asyncio.get_running_loop().time()
+            if firma != ultima_firma:
+                yield _evento_sse("estado", consulta_id, actual)
+                ultima_firma = firma
+                ultimo_envio = ahora
+            elif ahora - ultimo_envio >= SSE_HEARTBEAT_SECONDS:
+                yield ": keep-alive\n\n"
+                ultimo_envio = ahora
+            await asyncio.sleep(LONG_POLL_TICK_SECONDS)
+            actual = await run_in_threadpool(db.obtener_consulta, consulta_id)
+            if not actual:
+                # La consulta se borró durante el stream: evento final y fin del stream
+                detalle = {"consulta_id": consulta_id, "detail": "Consulta no encontrada"}
+                yield f"event: error\ndata: {json.dumps(detalle, ensure_ascii=False)}\n\n"
+                return
+
+    return StreamingResponse(generar_eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/queries")
 async def listar_consultas(
     estado: str = None,
@@ -1,16 +1,62 @@
 import os
+import re
+import errno
 import logging
 import shutil
 import tarfile
-from typing import List, Dict, Iterable, Optional
-from datetime import datetime, timezone
+import subprocess
+import tempfile
+import queue
+from contextlib import contextmanager
+from typing import List, Dict, Iterable, Optional, Union
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from pebble import ProcessPool, ThreadPool
-from concurrent.futures import TimeoutError
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, as_completed, wait
 from database import ConsultasDatabase
 from collections import defaultdict
+import threading
 import time
-from s3_recover import S3RecoverFiles
+from bisect import bisect_right
+from functools import lru_cache
+from s3_recover import PROGRESS_UPDATE_INTERVAL_SECONDS, S3RecoverFiles, clave_cobertura, parse_fecha_juliana
+
+# Hilos que escriben en paralelo los miembros extraídos de cada .tgz (1 = secuencial);
+# el tar se lee siempre en una sola pasada y se reparte en bloques de 1 MiB
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "1"))
+# Descompresor gzip externo multihilo (p. ej. pigz), opcional; vacío o fuera del PATH = zlib
+EXTRACT_GZIP_CMD = os.getenv("EXTRACT_GZIP_CMD", "")
+# Copia de .tgz completos: número de flujos pread/pwrite en paralelo y tamaño mínimo
+# a partir del cual se usan (por debajo, un solo sendfile es suficiente)
+COPY_STREAMS = int(os.getenv("COPY_STREAMS", "4"))
+COPY_PARALLEL_MIN_BYTES = int(os.getenv("COPY_PARALLEL_MIN_MB", "256")) * 1024 * 1024
+# Vigencia (segundos) del listado cacheado de cada directorio semanal de Lustre (0 = sin caché).
+# La semana que contiene el día UTC en curso sigue recibiendo archivos y siempre se lista de nuevo.
+LUSTRE_LISTING_TTL_SECONDS = int(os.getenv("LUSTRE_LISTING_TTL_SECONDS", "300"))
+
+
+def _rangos_horarios(horarios_list: list) -> list:
+    """Convierte ['HH:MM-HH:MM', 'HH:MM', ...] en tuplas (inicio_hh, fin_hh) una sola vez."""
+    rangos = []
+    for horario_str in horarios_list:
+        partes = horario_str.split('-')
+        inicio_hh = partes[0][:2]
+        fin_hh = partes[1][:2] if len(partes) > 1 else inicio_hh
+        rangos.append((inicio_hh, fin_hh))
+    return rangos
+
+
+# Timestamps en nombres de archivo, compilados una sola vez:
+# NetCDF '..._sYYYYJJJHH[MM...]' y .tgz de Lustre '...-sYYYYJJJHHMM...'.
+_TS_RE = re.compile(r'_s(\d{7})(\d{2})')
+_TS_TGZ_RE = re.compile(r'-s(\d{11})')
+_TS_ESCANEO_RE = re.compile(r'[-_]s(\d{11})')
+
+
+def _escaneo_de_archivo(nombre: str) -> Optional[str]:
+    """Inicio de escaneo 'YYYYJJJHHMM' de un .tgz ('-s') o NetCDF ('_s'); None si no tiene."""
+    m = _TS_ESCANEO_RE.search(nombre)
+    return m.group(1) if m is not None else None
 
 
 def filter_files_by_time(archivos_nc: list, fecha_jjj: str, horarios_list: list) -> list:
@@ -18,30 +64,60 @@ def filter_files_by_time(archivos_nc: list, fecha_jjj: str, horarios_list: list)
     Filtra archivos NetCDF por fecha juliana y rango horario.
     Compatible con archivos S3 (string) y rutas locales NetCDF.
     """
+    # Los rangos se parsean una vez; cada nombre se recorre una sola vez.
+    rangos = _rangos_horarios(horarios_list)
     archivos_filtrados = []
+    buscar_ts = _TS_RE.search
     for archivo in archivos_nc:
         nombre = archivo.name if hasattr(archivo, "name") else archivo
-        s_idx = nombre.find('_s')
-        e_idx = nombre.find('_e')
-        if s_idx == -1 or e_idx == -1:
-            continue
-        ts_str = nombre[s_idx+2:e_idx]  # Ej: '20211211900163'
-        if len(ts_str) < 9:
-            continue
-        anio = ts_str[:4]
-        dia_juliano = ts_str[4:7]
-        hora = ts_str[7:9]
-        if anio + dia_juliano != fecha_jjj:
+        m = buscar_ts(nombre)  # Ej: '_s20211211900163' -> ('2021121', '19')
+        if m is None or m.group(1) != fecha_jjj:
             continue
-        for horario_str in horarios_list:
-            partes = horario_str.split('-')
-            inicio_hh = partes[0][:2]
-            fin_hh = partes[1][:2] if len(partes) > 1 else inicio_hh
+        hora = m.group(2)
+        for inicio_hh, fin_hh in rangos:
             if inicio_hh <= hora <= fin_hh:
                 archivos_filtrados.append(archivo)
                 break
     return archivos_filtrados
 
+
+def _hhmm_a_minutos(hhmm: str) -> int:
+    """Convierte 'HH:MM' en minutos desde medianoche, validando como strptime('%H:%M')."""
+    hh, sep, mm = hhmm.partition(':')
+    if not sep or not hh.isdigit() or not mm.isdigit() or len(mm) != 2:
+        raise ValueError(f"Hora inválida: {hhmm}")
+    horas, minutos = int(hh), int(mm)
+    if horas > 23 or minutos > 59:
+        raise ValueError(f"Hora inválida: {hhmm}")
+    return horas * 60 + minutos
+
+
+@lru_cache(maxsize=256)
+def _listar_semana(directorio_semana: str, ventana: int) -> Dict[str, tuple]:
+    """
+    Lista (un solo readdir) los .tgz de un directorio semanal de Lustre, indexados
+    por el día juliano 'YYYYJJJ' de su timestamp '-s'. Los nombres sin timestamp se
+    omiten: filter_files_by_time los descartaría de todos modos.
+    'ventana' es el intervalo de TTL vigente: al cambiar, la entrada cacheada deja de usarse.
+    Un directorio inexistente lanza FileNotFoundError y no se cachea.
+    """
+    por_dia = defaultdict(list)
+    with os.scandir(directorio_semana) as entradas:
+        for e in entradas:
+            if not e.name.endswith('.tgz'):
+                continue
+            m = _TS_TGZ_RE.search(e.name)
+            if m is not None:
+                por_dia[m.group(1)[:7]].append(e.name)
+    return {dia: tuple(nombres) for dia, nombres in por_dia.items()}
+
+
+def _listado_semana(directorio_semana: Path, reciente: bool = False) -> Dict[str, tuple]:
+    if reciente or LUSTRE_LISTING_TTL_SECONDS <= 0:
+        return _listar_semana.__wrapped__(str(directorio_semana), 0)
+    return _listar_semana(str(directorio_semana), int(time.monotonic() // LUSTRE_LISTING_TTL_SECONDS))
+
+
 # --- Clase para recuperación local (Lustre) ---
 class LustreRecoverFiles:
     def __init__(self, source_data_path: str, logger):
@@ -61,16 +137,23 @@ class LustreRecoverFiles:
         dia_del_anio_int = int(fecha_jjj[4:])
         semana = (dia_del_anio_int - 1) // 7 + 1
         directorio_semana = base_path / anio / f"{semana:02d}"
-        if not directorio_semana.exists():
+        # Una semana que no ha terminado (día UTC en curso o posterior) puede tener .tgz nuevos
+        fin_semana = datetime(int(anio), 1, 1, tzinfo=timezone.utc) + timedelta(days=semana * 7 - 1)
+        semana_reciente = fin_semana.date() >= datetime.now(timezone.utc).date()
+        try:
+            # Listado de la semana cacheado: días de la misma semana no vuelven a leer el directorio
+            indice_semana = _listado_semana(directorio_semana, semana_reciente)
+        except (FileNotFoundError, NotADirectoryError):
             self.logger.warning(f"⚠️ Directorio no encontrado en Lustre: {directorio_semana}")
             return []
-        patron_dia = f"*{anio}{dia_del_anio_int:03d}*.tgz"
-        archivos_candidatos = list(directorio_semana.glob(patron_dia))
+        clave_dia = f"{anio}{dia_del_anio_int:03d}"
+        archivos_candidatos = [directorio_semana / n for n in indice_semana.get(clave_dia, ())]
         self.logger.debug(f"  Directorio: {directorio_semana}, Candidatos para el día {fecha_jjj}: {len(archivos_candidatos)}")
         return archivos_candidatos
 
     def filter_files_by_time(self, archivos_candidatos: List[Path], fecha_jjj: str, horarios_list: List[str]) -> List[Path]:
-        archivos_filtrados_dia = []
+        # Precalcular los rangos enteros una vez; luego una sola pasada por los candidatos.
+        rangos = []
         for horario_str in horarios_list:
             partes = horario_str.split('-')
             inicio_hhmm = partes[0].replace(':', '')
@@ -78,22 +161,25 @@ class LustreRecoverFiles:
             inicio_ts_str = f"{fecha_jjj}{inicio_hhmm[:2]}00"
             fin_ts_str = f"{fecha_jjj}{fin_hhmm[:2]}59"
             try:
-                inicio_ts = int(inicio_ts_str)
-                fin_ts = int(fin_ts_str)
+                rangos.append((int(inicio_ts_str), int(fin_ts_str)))
             except ValueError:
                 self.logger.warning(f"Formato de timestamp inválido para {fecha_jjj} con horario {horario_str}. Se omite.")
                 continue
-            self.logger.debug(f"    Filtrando por rango horario: {horario_str} ({inicio_ts} - {fin_ts})")
-            for archivo in archivos_candidatos:
-                try:
-                    s_part_start_idx = archivo.name.find('-s')
-                    if s_part_start_idx != -1:
-                        file_ts_str = archivo.name[s_part_start_idx + 2 : s_part_start_idx + 13]
-                        file_ts = int(file_ts_str)
-                        if inicio_ts <= file_ts <= fin_ts:
-                            archivos_filtrados_dia.append(archivo)
-                except (ValueError, IndexError, AttributeError):
-                    continue
+            self.logger.debug(f"    Filtrando por rango horario: {horario_str} ({rangos[-1][0]} - {rangos[-1][1]})")
+        if not rangos:
+            return []
+
+        archivos_filtrados_dia = []
+        buscar_ts = _TS_TGZ_RE.search
+        for archivo in archivos_candidatos:
+            m = buscar_ts(getattr(archivo, "name", ""))
+            if m is None:
+                continue
+            file_ts = int(m.group(1))
+            for inicio_ts, fin_ts in rangos:
+                if inicio_ts <= file_ts <= fin_ts:
+                    archivos_filtrados_dia.append(archivo)
+                    break
         return archivos_filtrados_dia
 
     def discover_and_filter_files(self, query_dict: Dict) -> List[Path]:
@@ -108,15 +194,33 @@ class LustreRecoverFiles:
         return sorted(list(archivos_encontrados_set))
 
     def scan_existing_files(self, archivos_a_procesar: List[Path], destino: Path) -> List[Path]:
-        if not destino.exists() or not any(destino.iterdir()):
+        # Timestamps (11 caracteres) que interesan; los archivos sin '_s' siempre quedan pendientes.
+        timestamps_buscados = set()
+        for archivo_fuente in archivos_a_procesar:
+            s_part_start_idx = archivo_fuente.name.find('_s')
+            if s_part_start_idx != -1:
+                timestamps_buscados.add(archivo_fuente.name[s_part_start_idx + 2 : s_part_start_idx + 13])
+        if not timestamps_buscados:
             return archivos_a_procesar
+
+        # Un solo listado del destino, que se corta en cuanto todos los timestamps
+        # buscados aparecieron (p. ej. pocos archivos fuente contra un destino enorme).
         timestamps_existentes = set()
-        for f in destino.iterdir():
-            if f.is_file():
-                s_part_start_idx = f.name.find('_s')
-                if s_part_start_idx != -1:
-                    timestamp_part = f.name[s_part_start_idx + 2 : s_part_start_idx + 13]
-                    timestamps_existentes.add(timestamp_part)
+        try:
+            with os.scandir(destino) as entradas:
+                for entrada in entradas:
+                    s_part_start_idx = entrada.name.find('_s')
+                    if s_part_start_idx == -1:
+                        continue
+                    timestamp = entrada.name[s_part_start_idx + 2 : s_part_start_idx + 13]
+                    if timestamp in timestamps_buscados and entrada.is_file(follow_symlinks=False):
+                        timestamps_existentes.add(timestamp)
+                        if len(timestamps_existentes) == len(timestamps_buscados):
+                            break
+        except FileNotFoundError:
+            return archivos_a_procesar
+        if not timestamps_existentes:
+            return archivos_a_procesar
         archivos_pendientes = []
         for archivo_fuente in archivos_a_procesar:
             s_part_start_idx = archivo_fuente.name.find('_s')
@@ -126,18 +230,20 @@ class LustreRecoverFiles:
                     archivos_pendientes.append(archivo_fuente)
             else:
                 archivos_pendientes.append(archivo_fuente)
-        num_recuperados = len(archivos_a_procesar) - len(archivos_pendientes)
         return archivos_pendientes
 
 
 # --- Clase principal orquestadora ---
 class RecoverFiles:
-    def __init__(self, db: ConsultasDatabase, source_data_path: str, base_download_path: str, executor, s3_fallback_enabled: Optional[bool] = None, lustre_enabled: Optional[bool] = None, max_workers: Optional[int] = None):
+    def __init__(self, db: ConsultasDatabase, source_data_path: str, base_download_path: str, executor, s3_fallback_enabled: Optional[bool] = None, lustre_enabled: Optional[bool] = None, max_workers: Optional[int] = None, cpu_executor=None):
         self.db = db
         self.source_data_path = Path(source_data_path)
         self.base_download_path = Path(base_download_path)
         self.logger = logging.getLogger(__name__)
         self.executor = executor
+        # Pool de procesos opcional para la extracción selectiva (descompresión, CPU);
+        # las copias de .tgz completos (E/S) siguen en el executor compartido.
+        self.cpu_executor = cpu_executor
         self.s3_fallback_enabled = (s3_fallback_enabled
                                     if s3_fallback_enabled is not None
                                     else os.getenv("S3_FALLBACK_ENABLED", "1") not in ("0", "false", "False"))
@@ -169,7 +275,16 @@ class RecoverFiles:
         try:
             # 1. Preparar entorno
             directorio_destino = self.base_download_path / consulta_id
-            directorio_destino.mkdir(exist_ok=True, parents=True)
+            # Si el destino ya tenía archivos (reanudación) el reporte debe listarlo;
+            # si no, basta con lo que escriban las etapas local y S3. Se intenta primero
+            # el listado y solo se crea el directorio si no existe: en Lustre un mkdir
+            # sobre un directorio existente también cuesta una operación de metadatos.
+            try:
+                with os.scandir(directorio_destino) as entradas:
+                    destino_tenia_archivos = next(entradas, None) is not None
+            except FileNotFoundError:
+                os.makedirs(directorio_destino, exist_ok=True)
+                destino_tenia_archivos = False
             self.db.actualizar_estado(consulta_id, "procesando", 10, "Preparando entorno")
 
             # 2. Descubrir y filtrar archivos locales.
@@ -179,7 +294,10 @@ class RecoverFiles:
             inaccessible_files_local = []  # Si tienes lógica para esto, agrégala aquí
 
             # 3. Escanear destino
-            if archivos_a_procesar_local:
+            if archivos_a_procesar_local and not destino_tenia_archivos:
+                # Destino nuevo o vacío: no hay nada que escanear
+                archivos_pendientes_local = list(archivos_a_procesar_local)
+            elif archivos_a_procesar_local:
                 archivos_pendientes_local = self.lustre.scan_existing_files(archivos_a_procesar_local, directorio_destino)
                 if not archivos_pendientes_local:
                     pass
@@ -191,29 +309,56 @@ class RecoverFiles:
 
             objetivos_fallidos_local = []
             objetivos_fallidos_local.extend(inaccessible_files_local)
+            local_recuperados = []
 
             # 4. Procesar archivos pendientes en paralelo
             if archivos_pendientes_local:
+                # Los argumentos comunes se preparan una vez como str/tuplas: con ProcessPool
+                # cada tarea los serializa, y así el payload por archivo es mínimo.
+                destino_str = str(directorio_destino)
+                nivel = query_dict.get('nivel')
+                productos = tuple(query_dict.get('productos') or ())
+                bandas = tuple(query_dict.get('bandas') or ())
+                # La decisión copia/extracción es la misma para toda la consulta
+                copiar_tgz_completo = _plan_extraccion(
+                    (nivel or "").upper(), frozenset(p.upper() for p in productos), frozenset(bandas)
+                )[0]
+                ejecutor = self.executor if copiar_tgz_completo or self.cpu_executor is None else self.cpu_executor
                 future_to_objetivo = {
-                    self.executor.schedule(
+                    self._agendar(
                         _process_safe_recover_file, 
-                        args=(
-                            archivo_a_procesar, 
-                            directorio_destino, 
-                            query_dict.get('nivel'), 
-                            query_dict.get('productos'), 
-                            query_dict.get('bandas')
-                        ), 
-                        timeout=self.FILE_PROCESSING_TIMEOUT_SECONDS
+                        (str(archivo_a_procesar), destino_str, nivel, productos, bandas),
+                        ejecutor
                     ): archivo_a_procesar
-                    for i, archivo_a_procesar in enumerate(archivos_pendientes_local)
+                    for archivo_a_procesar in archivos_pendientes_local
                 }
-                for i, future in enumerate(future_to_objetivo.keys()):
+                # El progreso solo toma ~60 valores distintos: escribir en DB únicamente
+                # cuando cambia, en lugar de una escritura por archivo.
+                # Se consumen por orden de terminación para que un archivo lento no
+                # frene el progreso ni la recolección de errores del resto.
+                # Además, como mucho una escritura cada PROGRESS_UPDATE_INTERVAL_SECONDS
+                # (la última siempre se escribe).
+                ultimo_progreso = 20
+                ultima_escritura = time.monotonic()
+                completados = 0
+                for future, vencido in self._esperar_tareas(future_to_objetivo, ejecutor):
                     archivo_fuente = future_to_objetivo[future]
-                    progreso = 20 + int(((i + 1) / total_pendientes) * 60)
-                    self.db.actualizar_estado(consulta_id, "procesando", progreso, f"Recuperando archivo {i+1}/{total_pendientes}")
+                    completados += 1
+                    progreso = 20 + int((completados / total_pendientes) * 60)
+                    ahora = time.monotonic()
+                    if progreso != ultimo_progreso and (
+                        completados == total_pendientes or ahora - ultima_escritura >= PROGRESS_UPDATE_INTERVAL_SECONDS
+                    ):
+                        self.db.actualizar_estado(consulta_id, "procesando", progreso, f"Recuperando archivo {completados}/{total_pendientes}")
+                        ultimo_progreso = progreso
+                        ultima_escritura = ahora
+                    if vencido:
+                        # Un hilo no puede interrumpirse: el archivo se da por fallido y la consulta sigue
+                        self.logger.error(f"❌ Procesamiento del archivo {archivo_fuente.name} excedió el tiempo límite de {self.FILE_PROCESSING_TIMEOUT_SECONDS}s; se marca como fallido.")
+                        objetivos_fallidos_local.append(archivo_fuente)
+                        continue
                     try:
-                        future.result()
+                        local_recuperados.extend(future.result() or [])
                     except TimeoutError:
                         self.logger.error(f"❌ Procesamiento del archivo {archivo_fuente.name} excedió el tiempo límite de {self.FILE_PROCESSING_TIMEOUT_SECONDS}s y fue terminado.")
                         objetivos_fallidos_local.append(archivo_fuente)
@@ -221,41 +366,45 @@ class RecoverFiles:
                         self.logger.error(f"❌ Error procesando el archivo {archivo_fuente.name}: {e}")
                         objetivos_fallidos_local.append(archivo_fuente)
 
-            # 5. Recuperar desde S3 si está habilitado
+            # 5. Recuperar desde S3 si está habilitado.
+            # Lo que Lustre ya entregó se mide por (nivel, producto, banda, escaneo): un .tgz
+            # de Lustre puede traer solo algunos productos o bandas de su escaneo, y lo que
+            # falte se sigue buscando en S3. Los .tgz copiados completos cubren su escaneo entero.
             if self.s3_fallback_enabled:
                 self.db.actualizar_estado(consulta_id, "procesando", 85, "Buscando archivos adicionales en S3.")
+                claves_cubiertas, escaneos_completos = self._cobertura_local(local_recuperados)
                 s3_map = {}
 
                 nivel = (query_dict.get("nivel") or "").upper()
                 if nivel == "L2":
-                    # Separar productos CMI* de no-CMI para no aplicar 'bandas' a ACHA/otros
-                    productos_req = (query_dict.get("productos") or [])
-                    productos_upper = [str(p).strip().upper() for p in productos_req]
-                    cmi_products = [p for p in productos_upper if p.startswith("CMI")]
-                    other_products = [p for p in productos_upper if not p.startswith("CMI")]
-
-                    # Consulta para CMI*: respeta 'bandas'
-                    if cmi_products:
-                        q_cmi = dict(query_dict)
-                        q_cmi["productos"] = cmi_products
-                        q_cmi["bandas"] = query_dict.get("bandas") or []
-                        s3_map.update(self.s3.discover_files(q_cmi, self.GOES19_OPERATIONAL_DATE))
-                    # Consulta para no-CMI: ignorar 'bandas'
-                    if other_products:
-                        q_other = dict(query_dict)
-                        q_other["productos"] = other_products
-                        q_other["bandas"] = []  # explícito: no filtrar por banda
-                        s3_map.update(self.s3.discover_files(q_other, self.GOES19_OPERATIONAL_DATE))
+                    # Una sola consulta: discover_files aplica 'bandas' solo a productos CMI*
+                    q_l2 = dict(query_dict)
+                    q_l2["productos"] = [str(p).strip().upper() for p in (query_dict.get("productos") or [])]
+                    q_l2["bandas"] = query_dict.get("bandas") or []
+                    if q_l2["productos"]:
+                        s3_map.update(self.s3.discover_files(
+                            q_l2, self.GOES19_OPERATIONAL_DATE,
+                            claves_cubiertas=claves_cubiertas, escaneos_completos=escaneos_completos,
+                        ))
                 elif nivel == "L1B":
                     # L1b: solo una consulta, usando bandas
-                    q_l1b = dict(query_dict)
-                    s3_map.update(self.s3.discover_files(q_l1b, self.GOES19_OPERATIONAL_DATE))
+                    s3_map.update(self.s3.discover_files(
+                        query_dict, self.GOES19_OPERATIONAL_DATE,
+                        claves_cubiertas=claves_cubiertas, escaneos_completos=escaneos_completos,
+                    ))
 
+                # Agrupar por día una sola vez: cada fecha filtra solo sus archivos
+                # en lugar de recorrer todo lo descubierto por cada clave de 'fechas'.
+                archivos_por_dia = defaultdict(list)
+                for ruta_s3 in s3_map.values():
+                    m = _TS_RE.search(ruta_s3.rsplit('/', 1)[-1])
+                    if m is not None:
+                        archivos_por_dia[m.group(1)].append(ruta_s3)
                 archivos_s3_filtrados = []
                 for fecha_jjj, horarios_list in query_dict.get('fechas', {}).items():
-                    archivos_encontrados = [s3_map[k] for k in s3_map]
-                    archivos_s3_filtrados += filter_files_by_time(archivos_encontrados, fecha_jjj, horarios_list)
-                objetivos_finales_s3 = list(set(archivos_s3_filtrados))
+                    archivos_s3_filtrados += filter_files_by_time(archivos_por_dia.get(fecha_jjj, []), fecha_jjj, horarios_list)
+                # Deduplicar por clave S3 conservando el orden (agrupado por prefijo)
+                objetivos_finales_s3 = list(dict.fromkeys(archivos_s3_filtrados))
                 # Publicar un mensaje con conteo antes de iniciar descargas
                 try:
                     total_s3 = len(objetivos_finales_s3)
@@ -273,7 +422,14 @@ class RecoverFiles:
                 objetivos_fallidos_final = objetivos_fallidos_local
 
             # 6. Generar reporte final
-            all_files_in_destination = [f for f in directorio_destino.iterdir() if f.is_file()]
+            if destino_tenia_archivos:
+                with os.scandir(directorio_destino) as entradas:
+                    # Los temporales ocultos ('.<nombre>.partN') de descargas en curso no forman parte del reporte
+                    # Se pasan los DirEntry tal cual: el reporte solo necesita name y stat()
+                    all_files_in_destination = [e for e in entradas if not e.name.startswith('.') and e.is_file(follow_symlinks=False)]
+            else:
+                # Destino nuevo: su contenido es exactamente lo recuperado en esta ejecución
+                all_files_in_destination = list({p.name: p for p in (*local_recuperados, *s3_recuperados)}.values())
             self.db.actualizar_estado(consulta_id, "procesando", 95, "Generando reporte final")
             resultados_finales = self._generar_reporte_final(
                 consulta_id, all_files_in_destination, s3_recuperados, directorio_destino, objetivos_fallidos_final, query_dict
@@ -290,45 +446,132 @@ class RecoverFiles:
             self.logger.error(f"❌ Error procesando consulta {consulta_id}: {e}")
             self.db.actualizar_estado(consulta_id, "error", 0, f"Error: {str(e)}")
 
+    def _cobertura_local(self, recuperados_locales: List[Path]) -> tuple:
+        """
+        (claves, escaneos_completos) de lo recuperado desde Lustre: las claves
+        (nivel, producto, banda, escaneo) de cada NetCDF extraído y los escaneos de los
+        .tgz copiados completos. Los archivos fuente que fallaron no aportan nada.
+        """
+        claves = set()
+        escaneos_completos = set()
+        for archivo in recuperados_locales:
+            if archivo.name.endswith('.tgz'):
+                escaneo = _escaneo_de_archivo(archivo.name)
+                if escaneo is not None:
+                    escaneos_completos.add(escaneo)
+                continue
+            clave = clave_cobertura(archivo.name)
+            if clave is not None:
+                claves.add(clave)
+        return claves, escaneos_completos
+
+    def _esperar_tareas(self, futures: Iterable, executor) -> Iterable[tuple]:
+        """
+        Entrega (future, vencido) por orden de terminación. Con ProcessPool el
+        timeout lo aplica pebble (el future falla con TimeoutError). Con ThreadPool
+        se vigila aquí: una tarea que lleva más de FILE_PROCESSING_TIMEOUT_SECONDS
+        en ejecución se entrega como vencida, de modo que una lectura colgada en
+        Lustre/NFS no bloquea la consulta para siempre (el hilo queda ocupado).
+        """
+        if not isinstance(executor, ThreadPool):
+            for future in as_completed(futures):
+                yield future, False
+            return
+
+        plazo = self.FILE_PROCESSING_TIMEOUT_SECONDS
+        pendientes = set(futures)
+        inicio_ejecucion = {}
+        while pendientes:
+            listos, pendientes = wait(pendientes, timeout=min(1.0, plazo), return_when=FIRST_COMPLETED)
+            for future in listos:
+                yield future, False
+            ahora = time.monotonic()
+            for future in list(pendientes):
+                if not future.running():
+                    continue
+                inicio = inicio_ejecucion.setdefault(future, ahora)
+                if ahora - inicio > plazo:
+                    pendientes.discard(future)
+                    yield future, True
+
+    def _agendar(self, funcion, args: tuple, executor=None):
+        """
+        Agenda una tarea en el executor indicado (por defecto, el compartido).
+        pebble.ThreadPool no admite timeout por tarea (un hilo no puede
+        interrumpirse; el plazo lo vigila _esperar_tareas); el resto de
+        executors (ProcessPool) reciben FILE_PROCESSING_TIMEOUT_SECONDS.
+        """
+        executor = executor or self.executor
+        if isinstance(executor, ThreadPool):
+            return executor.schedule(funcion, args=args)
+        return executor.schedule(funcion, args=args, timeout=self.FILE_PROCESSING_TIMEOUT_SECONDS)
+
     def _build_recovery_query(self, consulta_id: str, objetivos_fallidos: List[Path], query_original: Dict) -> Optional[Dict]:
         """Construye una nueva consulta a partir de los archivos que fallaron."""
         if not objetivos_fallidos:
             return None
 
         fechas_fallidas = defaultdict(list)
+        rangos_vistos = set()  # (clave_fecha, rango) ya agregados; conserva el orden en fechas_fallidas
         original_fechas = query_original.get('_original_request', {}).get('fechas', {})
 
+        # Precalcular una sola vez los rangos de fecha (YYYYMMDD como enteros) y de hora
+        # (minutos) de la solicitud original, en lugar de re-parsearlos por archivo fallido.
+        rangos_originales = []
+        for fecha_key_original, horarios_list in original_fechas.items():
+            try:
+                inicio_ymd = int(fecha_key_original.split('-')[0])
+                fin_ymd = int(fecha_key_original.split('-')[-1])
+            except ValueError:
+                continue
+            rangos_horarios = []
+            for horario_rango in horarios_list:
+                inicio_str, fin_str = (horario_rango.split('-') + [horario_rango])[:2]
+                try:
+                    rangos_horarios.append((_hhmm_a_minutos(inicio_str), _hhmm_a_minutos(fin_str), horario_rango))
+                except ValueError:
+                    continue
+            rangos_originales.append((inicio_ymd, fin_ymd, fecha_key_original, rangos_horarios))
+
+        # Si las claves de fecha no se solapan (lo habitual), cada archivo cae en a lo sumo
+        # una de ellas y se localiza con bisect; si se solapan, se conserva el recorrido en
+        # el orden original de la solicitud.
+        rangos_ordenados = sorted(rangos_originales, key=lambda r: r[0])
+        inicios_ordenados = [r[0] for r in rangos_ordenados]
+        sin_solapes = all(a[1] < b[0] for a, b in zip(rangos_ordenados, rangos_ordenados[1:]))
+
         for archivo_fallido in objetivos_fallidos:
             try:
                 # 1. Extraer el timestamp YYYYJJJHHMM del nombre del archivo.
                 ts_str = archivo_fallido.name.split('-s')[1].split('.')[0][:11]
-                fecha_fallida_dt = datetime.strptime(ts_str, '%Y%j%H%M')
-                fecha_fallida_ymd = fecha_fallida_dt.strftime('%Y%m%d')
-
-                # 2. Encontrar la clave de fecha y el rango horario originales.
-                for fecha_key_original, horarios_list in original_fechas.items():
-                    # Comprobar si la fecha del archivo está dentro del rango de la clave (ej. "20230101-20230105")
-                    start_date_str = fecha_key_original.split('-')[0]
-                    end_date_str = fecha_key_original.split('-')[-1]
-                    if not (start_date_str <= fecha_fallida_ymd <= end_date_str):
-                        continue
-
-                    for horario_rango in horarios_list:
-                        # Comprobar si la hora del archivo está dentro del rango horario.
-                        inicio_str, fin_str = (horario_rango.split('-') + [horario_rango])[:2]
-                        inicio_t = datetime.strptime(inicio_str, '%H:%M').time()
-                        fin_t = datetime.strptime(fin_str, '%H:%M').time()
-
-                        if inicio_t <= fecha_fallida_dt.time() <= fin_t:
-                            if horario_rango not in fechas_fallidas[fecha_key_original]:
-                                fechas_fallidas[fecha_key_original].append(horario_rango)
-                            break # Encontrado el rango horario, pasar al siguiente archivo.
-                    else:
-                        continue
-                    break # Encontrada la clave de fecha, pasar al siguiente archivo.
-
+                fecha_fallida_dt = parse_fecha_juliana(ts_str)
             except (IndexError, ValueError):
                 continue
+            fecha_fallida_ymd = fecha_fallida_dt.year * 10000 + fecha_fallida_dt.month * 100 + fecha_fallida_dt.day
+            minutos_fallidos = fecha_fallida_dt.hour * 60 + fecha_fallida_dt.minute
+
+            if sin_solapes:
+                idx = bisect_right(inicios_ordenados, fecha_fallida_ymd) - 1
+                candidatos = rangos_ordenados[idx:idx + 1] if idx >= 0 else []
+            else:
+                candidatos = rangos_originales
+
+            # 2. Encontrar la clave de fecha y el rango horario originales.
+            for inicio_ymd, fin_ymd, fecha_key_original, rangos_horarios in candidatos:
+                # Comprobar si la fecha del archivo está dentro del rango de la clave (ej. "20230101-20230105")
+                if not (inicio_ymd <= fecha_fallida_ymd <= fin_ymd):
+                    continue
+
+                for inicio_min, fin_min, horario_rango in rangos_horarios:
+                    # Comprobar si la hora del archivo está dentro del rango horario.
+                    if inicio_min <= minutos_fallidos <= fin_min:
+                        if (fecha_key_original, horario_rango) not in rangos_vistos:
+                            rangos_vistos.add((fecha_key_original, horario_rango))
+                            fechas_fallidas[fecha_key_original].append(horario_rango)
+                        break # Encontrado el rango horario, pasar al siguiente archivo.
+                else:
+                    continue
+                break # Encontrada la clave de fecha, pasar al siguiente archivo.
 
         if fechas_fallidas:
             consulta_recuperacion = query_original.get('_original_request', {}).copy()
@@ -339,15 +582,22 @@ class RecoverFiles:
         
         return None
 
-    def _generar_reporte_final(self, consulta_id: str, all_files_in_destination: List[Path], s3_recuperados: List[Path], directorio_destino: Path, objetivos_fallidos: List[Path], query_original: Dict) -> Dict:
+    def _generar_reporte_final(self, consulta_id: str, all_files_in_destination: List[Union[Path, os.DirEntry]], s3_recuperados: List[Path], directorio_destino: Path, objetivos_fallidos: List[Path], query_original: Dict) -> Dict:
         """Genera el diccionario de resultados finales."""
         # Optimizar: usar comparación por nombre con set para evitar O(n^2)
         s3_names_full = [p.name for p in s3_recuperados]
         s3_names_set = set(s3_names_full)
         lustre_names_full = [p.name for p in all_files_in_destination if p.name not in s3_names_set]
         todos_los_archivos = all_files_in_destination
-        # Cálculo de tamaño total (puede ser costoso con cientos de miles de archivos)
-        total_bytes = sum(f.stat().st_size for f in todos_los_archivos if f.is_file())
+        # Cálculo de tamaño total (puede ser costoso con cientos de miles de archivos):
+        # un stat por archivo ya conocido, sin volver a listar el directorio.
+        # Path y DirEntry exponen stat(); el de DirEntry queda cacheado en la entrada.
+        total_bytes = 0
+        for f in todos_los_archivos:
+            try:
+                total_bytes += f.stat().st_size
+            except OSError:
+                continue
         tamaño_mb = round(total_bytes / (1024 * 1024), 2)
 
         # Construir la consulta de recuperación usando el método refactorizado.
@@ -454,73 +704,322 @@ class RecoverFiles:
 # ProcessPoolExecutor requiere que las funciones que se ejecutan en otros procesos
 # estén definidas a nivel superior del módulo, no como métodos de una clase.
 
-def _process_safe_recover_file(archivo_fuente: Path, directorio_destino: Path, nivel: str, productos_solicitados_list: List[str], bandas_solicitadas_list: List[str]) -> List[Path]:
+def _sendfile_copy(origen: Path, destino: Path) -> None:
     """
-    Función segura para procesos que procesa un único archivo .tgz.
-    Verifica accesibilidad, y luego lo copia o extrae su contenido según la consulta.
+    Copia un archivo con os.sendfile en bloques de 16 MiB: los bytes no pasan por
+    espacio de usuario. Si el sistema de archivos no lo soporta, se copia con un
+    búfer de 1 MiB. Los archivos grandes (>= COPY_PARALLEL_MIN_BYTES) se copian en
+    COPY_STREAMS flujos paralelos. Conserva los permisos, igual que shutil.copy.
     """
-    archivos_recuperados = []
-    
-    # Normalizar entradas para facilitar las comprobaciones
-    productos_solicitados = set(p.upper() for p in (productos_solicitados_list or []))
-    bandas_solicitadas = set(bandas_solicitadas_list or [])
-    nivel_upper = (nivel or "").upper()
+    with open(origen, 'rb') as fin, open(destino, 'wb') as fout:
+        tamaño = os.fstat(fin.fileno()).st_size
+        _reservar_espacio(fout.fileno(), tamaño)
+        if COPY_STREAMS > 1 and tamaño >= COPY_PARALLEL_MIN_BYTES:
+            _copia_multiflujo(fin.fileno(), fout.fileno(), tamaño, COPY_STREAMS)
+            shutil.copymode(origen, destino)
+            return
+        offset = 0
+        try:
+            while True:
+                enviados = os.sendfile(fout.fileno(), fin.fileno(), offset, 1 << 24)
+                if enviados == 0:
+                    break
+                offset += enviados
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+            fin.seek(offset)
+            fout.seek(offset)
+            shutil.copyfileobj(fin, fout, length=1 << 20)
+    shutil.copymode(origen, destino)
+
+
+def _reservar_espacio(fd: int, tamaño: int) -> None:
+    """
+    Reserva de una vez el espacio del archivo destino (posix_fallocate): en
+    Lustre evita que el archivo crezca bloque a bloque y se fragmente entre
+    stripes. Si el sistema de archivos no lo soporta, se sigue sin reservar.
+    """
+    if tamaño <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, tamaño)
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP):
+            raise
+
+
+_BLOQUE_COPIA = 4 << 20
+
+
+def _copia_multiflujo(fd_origen: int, fd_destino: int, tamaño: int, flujos: int) -> None:
+    """
+    Copia [0, tamaño) en 'flujos' rangos contiguos, cada uno en su hilo con
+    os.pread/os.pwrite posicionales: un único flujo no alcanza el ancho de banda
+    de Lustre, varios en paralelo sí.
+    """
+    os.ftruncate(fd_destino, tamaño)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd_origen, 0, tamaño, os.POSIX_FADV_SEQUENTIAL)
+
+    def copiar_rango(inicio: int, fin: int) -> None:
+        offset = inicio
+        while offset < fin:
+            datos = os.pread(fd_origen, min(_BLOQUE_COPIA, fin - offset), offset)
+            if not datos:
+                raise OSError(errno.EIO, f"Lectura corta en offset {offset} de {tamaño}")
+            vista = memoryview(datos)
+            while vista:
+                escritos = os.pwrite(fd_destino, vista, offset)
+                vista = vista[escritos:]
+                offset += escritos
 
+    por_flujo = -(-tamaño // flujos)
+    with ThreadPoolExecutor(max_workers=flujos) as pool:
+        rangos = [pool.submit(copiar_rango, inicio, min(inicio + por_flujo, tamaño))
+                  for inicio in range(0, tamaño, por_flujo)]
+        for rango in rangos:
+            rango.result()
+
+
+_TODAS_LAS_BANDAS = frozenset(f"{i:02d}" for i in range(1, 17))
+
+
+def _compilar_agujas(agujas: Iterable[str]) -> Optional[re.Pattern]:
+    """Compila subcadenas literales en una sola alternancia; None si no hay ninguna (nunca coincide)."""
+    agujas = sorted(set(agujas))
+    if not agujas:
+        return None
+    return re.compile("|".join(re.escape(a) for a in agujas))
+
+
+def _descompresor_externo() -> Optional[str]:
+    """Ruta del descompresor externo configurado, o None si no está disponible."""
+    return shutil.which(EXTRACT_GZIP_CMD) if EXTRACT_GZIP_CMD else None
+
+
+@contextmanager
+def _abrir_tgz_stream(archivo_fuente: Path):
+    """
+    Abre un .tgz en modo streaming. Si hay un descompresor externo (pigz) el gzip
+    se descomprime en otro proceso y tarfile solo lee el tar plano desde el pipe;
+    si no, se usa el "r|gz" de siempre.
+    """
+    comando = _descompresor_externo()
+    if comando is None:
+        with open(archivo_fuente, 'rb', buffering=1 << 20) as fuente, \
+                tarfile.open(fileobj=fuente, mode="r|gz") as tar:
+            yield tar
+        return
+
+    # stderr va a un archivo temporal y no a un pipe: un descompresor que escribe más
+    # avisos de los que caben en el pipe se bloquearía mientras tarfile espera en stdout.
+    with tempfile.TemporaryFile() as errores:
+        proc = subprocess.Popen([comando, '-dc', str(archivo_fuente)], stdout=subprocess.PIPE,
+                                stderr=errores, bufsize=1 << 20)
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                yield tar
+            # Drenar el relleno final del tar para que el descompresor termine sin SIGPIPE
+            while proc.stdout.read(1 << 20):
+                pass
+            proc.stdout.close()
+            if proc.wait() != 0:
+                errores.seek(0)
+                error = errores.read().decode(errors="replace").strip()
+                raise tarfile.ReadError(f"{Path(comando).name} terminó con código {proc.returncode}: {error}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+
+@lru_cache(maxsize=64)
+def _plan_extraccion(nivel_upper: str, productos_solicitados: frozenset, bandas_solicitadas: frozenset) -> tuple:
+    """
+    Devuelve (copiar_tgz_completo, re_bandas, re_bandas_cmi, re_productos, todos_los_productos)
+    para una consulta. Se cachea: todos los .tgz de una misma consulta comparten el plan.
+    """
     # --- Lógica de decisión: Copiar .tgz completo vs. Extracción selectiva ---
     # Basado en las reglas definidas:
     # 1. L1b y bandas="ALL" -> Copiar .tgz completo.
     # 2. L2, bandas="ALL" y productos="ALL" -> Copiar .tgz completo.
     # 3. En todos los demás casos, se debe extraer selectivamente.
-    
+
+    # Las bandas llegan ya expandidas ('ALL' -> 01..16), así que el conjunto completo equivale a 'ALL'.
+    todas_las_bandas = 'ALL' in bandas_solicitadas or _TODAS_LAS_BANDAS <= bandas_solicitadas
     copiar_tgz_completo = (
-        (nivel_upper == 'L1B' and 'ALL' in bandas_solicitadas) or
-        (nivel_upper == 'L2' and 'ALL' in bandas_solicitadas and 'ALL' in productos_solicitados)
+        (nivel_upper == 'L1B' and todas_las_bandas) or
+        (nivel_upper == 'L2' and todas_las_bandas and 'ALL' in productos_solicitados)
+    )
+
+    # --- Lógica de extracción selectiva ---
+    # Determinar qué bandas usar para productos CMI
+    # Si se pidió 'ALL', se usan todas (1-16). Si no, se usan las especificadas.
+    bandas_para_cmi = _TODAS_LAS_BANDAS if 'ALL' in bandas_solicitadas else bandas_solicitadas
+    # Predicados compilados: una búsqueda en C por miembro en lugar de un any(...)
+    # con una comparación Python por producto/banda.
+    return (
+        copiar_tgz_completo,
+        _compilar_agujas(f"C{b}_" for b in bandas_solicitadas),
+        _compilar_agujas(f"C{b}_" for b in bandas_para_cmi),
+        _compilar_agujas(f"-L2-{p}" for p in productos_solicitados),
+        'ALL' in productos_solicitados,
+    )
+
+
+def _process_safe_recover_file(archivo_fuente: Union[str, Path], directorio_destino: Union[str, Path], nivel: str, productos_solicitados_list: Iterable[str], bandas_solicitadas_list: Iterable[str]) -> List[Path]:
+    """
+    Función segura para procesos que procesa un único archivo .tgz.
+    Verifica accesibilidad, y luego lo copia o extrae su contenido según la consulta.
+    Acepta rutas como str (lo que se envía al pool) o Path.
+    """
+    archivo_fuente = Path(archivo_fuente)
+    directorio_destino = Path(directorio_destino)
+    archivos_recuperados = []
+    
+    # Normalizar entradas; el plan (decisión de copia y predicados compilados) se
+    # calcula una vez por combinación nivel/productos/bandas, es decir, por consulta.
+    productos_solicitados = frozenset(p.upper() for p in (productos_solicitados_list or []))
+    bandas_solicitadas = frozenset(bandas_solicitadas_list or [])
+    nivel_upper = (nivel or "").upper()
+    copiar_tgz_completo, re_bandas, re_bandas_cmi, re_productos, todos_los_productos = _plan_extraccion(
+        nivel_upper, productos_solicitados, bandas_solicitadas
     )
 
     if copiar_tgz_completo:
-        shutil.copy(archivo_fuente, directorio_destino)
-        archivos_recuperados.append(directorio_destino / archivo_fuente.name)
+        destino = directorio_destino / archivo_fuente.name
+        _sendfile_copy(archivo_fuente, destino)
+        archivos_recuperados.append(destino)
         return archivos_recuperados
 
-    # --- Lógica de extracción selectiva ---
-    try:
-        with tarfile.open(archivo_fuente, "r:gz") as tar:
-            miembros_del_tar = tar.getmembers()
-            miembros_a_extraer = []
+    # Con EXTRACT_CONCURRENCY > 1 el tar se sigue leyendo en una sola pasada, pero cada
+    # miembro se escribe en un hilo del pool: el lector le pasa bloques de 1 MiB por una
+    # cola y sigue con el siguiente miembro mientras los anteriores terminan de escribirse.
+    # A lo sumo 4x concurrencia bloques en vuelo, así que la memoria sigue acotada.
+    concurrencia = max(1, EXTRACT_CONCURRENCY)
+    escritor = ThreadPoolExecutor(max_workers=concurrencia) if concurrencia > 1 else None
+    cupo = threading.BoundedSemaphore(concurrencia * 4)
+    escrituras = []
+    directorios_creados = set()
+    raiz_destino = os.path.realpath(directorio_destino)
 
-            # Determinar qué bandas usar para productos CMI
-            # Si se pidió 'ALL', se usan todas (1-16). Si no, se usan las especificadas.
-            bandas_para_cmi = {f"{i:02d}" for i in range(1, 17)} if 'ALL' in bandas_solicitadas else bandas_solicitadas
-
-            # Iterar sobre cada archivo dentro del .tgz
-            for miembro in miembros_del_tar:
+    try:
+        # Modo streaming: una sola pasada secuencial sobre el gzip,
+        # decidiendo por miembro si se extrae, sin construir el índice completo.
+        with _abrir_tgz_stream(archivo_fuente) as tar:
+            for miembro in tar:
+                # En modo stream TarFile igual acumula cada TarInfo en tar.members;
+                # vaciarlo mantiene la memoria constante aunque el tgz tenga miles de miembros.
+                tar.members = []
+                # Solo archivos regulares: enlaces, dispositivos y directorios no se extraen
                 if not miembro.isfile():
                     continue
+                nombre = miembro.name
 
                 # Lógica para L1b: extraer si la banda está en la lista solicitada
-                if nivel_upper == 'L1B' and any(f"C{b}_" in miembro.name for b in bandas_solicitadas):
-                    miembros_a_extraer.append(miembro)
+                if nivel_upper == 'L1B':
+                    extraer = re_bandas is not None and re_bandas.search(nombre) is not None
+                # Lógica para L2: producto solicitado y, si es CMI, también la banda
+                elif nivel_upper == 'L2':
+                    producto_match = todos_los_productos or (re_productos is not None and re_productos.search(nombre) is not None)
+                    banda_match = 'CMI' not in nombre or (re_bandas_cmi is not None and re_bandas_cmi.search(nombre) is not None)
+                    extraer = producto_match and banda_match
+                else:
+                    extraer = False
+
+                if not extraer:
+                    continue
+                destino = _destino_seguro(miembro, directorio_destino, raiz_destino)
+                if destino is None:
+                    logging.warning(f"⚠️ Miembro '{nombre}' de {archivo_fuente.name} omitido: su ruta sale del destino")
                     continue
+                if destino.parent not in directorios_creados:
+                    destino.parent.mkdir(parents=True, exist_ok=True)
+                    directorios_creados.add(destino.parent)
+                if escritor is None:
+                    # Copia directa del stream al destino con búfer de 1 MiB (tarfile usa 16 KiB)
+                    with tar.extractfile(miembro) as origen, open(destino, 'wb') as salida:
+                        shutil.copyfileobj(origen, salida, 1 << 20)
+                else:
+                    # El stream solo avanza hacia adelante: los bloques se leen aquí en orden
+                    # y el hilo del pool los escribe; el sentinela None cierra el miembro
+                    # aunque la lectura falle a medias, para que su hilo no quede esperando.
+                    bloques = queue.SimpleQueue()
+                    escrituras.append(escritor.submit(_escribir_miembro, destino, bloques, cupo))
+                    try:
+                        with tar.extractfile(miembro) as origen:
+                            while True:
+                                bloque = origen.read(1 << 20)
+                                if not bloque:
+                                    break
+                                cupo.acquire()
+                                bloques.put(bloque)
+                    finally:
+                        bloques.put(None)
+                archivos_recuperados.append(destino)
 
-                # Lógica para L2: más compleja
-                if nivel_upper == 'L2':
-                    # Extraer si el producto está en la lista (o si se pidió 'ALL' productos)
-                    if 'ALL' in productos_solicitados or any(f"-L2-{p.upper()}" in miembro.name for p in productos_solicitados):
-                        # Si es un producto CMI, verificar también la banda
-                        if 'CMI' in miembro.name and not any(f"C{b}_" in miembro.name for b in bandas_para_cmi):
-                            continue  # Es CMI pero no de la banda correcta, saltar
-                        miembros_a_extraer.append(miembro)
-            
-            if miembros_a_extraer:
-                tar.extractall(path=directorio_destino, members=miembros_a_extraer)
-                for miembro in miembros_a_extraer:
-                    archivos_recuperados.append(directorio_destino / miembro.name)
-            
-            if not miembros_a_extraer:
-                raise FileNotFoundError(f"No se encontraron archivos internos que coincidieran con la solicitud en {archivo_fuente.name}")
+        for escritura in escrituras:
+            escritura.result()
+
+        if not archivos_recuperados:
+            raise FileNotFoundError(f"No se encontraron archivos internos que coincidieran con la solicitud en {archivo_fuente.name}")
 
     except (tarfile.ReadError, tarfile.ExtractError, FileNotFoundError) as e:
         logging.error(f"❌ Error al procesar el archivo tar {archivo_fuente.name} (posiblemente corrupto): {e}")
         raise
+    finally:
+        if escritor is not None:
+            escritor.shutdown(wait=True)
+
+    return archivos_recuperados
+
+
+def _destino_seguro(miembro: tarfile.TarInfo, directorio_destino: Path, raiz_destino: str) -> Optional[Path]:
+    """
+    Ruta de salida de un miembro regular, o None si su nombre es absoluto, contiene
+    '..' o de otro modo quedaría fuera del destino. Con tarfile.data_filter
+    (Python >= 3.11.4) se aplican las mismas reglas que el filtro 'data' de extractall.
+    """
+    # Las rutas absolutas se rechazan (data_filter solo les quitaría la '/' inicial)
+    if os.path.isabs(miembro.name) or '..' in Path(miembro.name).parts:
+        return None
+    if hasattr(tarfile, "data_filter"):
+        try:
+            miembro = tarfile.data_filter(miembro, raiz_destino)
+        except tarfile.FilterError:
+            return None
+    nombre = miembro.name
+    if not os.path.realpath(os.path.join(raiz_destino, nombre)).startswith(raiz_destino + os.sep):
+        return None
+    return directorio_destino / nombre
+
 
-    return archivos_recuperados
\ No newline at end of file
+def _escribir_miembro(destino: Path, bloques: "queue.SimpleQueue", cupo: threading.BoundedSemaphore) -> None:
+    """
+    Escribe en `destino` los bloques que llegan por la cola hasta el sentinela None,
+    liberando un cupo por bloque. Ante un error de E/S se sigue vaciando la cola
+    (el lector no debe quedar bloqueado esperando cupo) y el error se relanza al final.
+    """
+    error = None
+    salida = None
+    try:
+        salida = open(destino, 'wb')
+    except OSError as e:
+        error = e
+    while True:
+        bloque = bloques.get()
+        if bloque is None:
+            break
+        try:
+            if error is None:
+                salida.write(bloque)
+        except OSError as e:
+            error = e
+        finally:
+            cupo.release()
+    if salida is not None:
+        salida.close()
+    if error is not None:
+        raise error
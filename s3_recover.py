@@ -1,9 +1,151 @@
+import os
+import random
+import re
+import threading
 import s3fs
 import time
 from pathlib import Path
-from typing import List, Dict, Optional
-from datetime import datetime, timezone
+from typing import AbstractSet, List, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pebble import ProcessPool, ThreadPool
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Tope (segundos) de la espera entre reintentos de descarga
+S3_RETRY_BACKOFF_CAP_SECONDS = 30
+# Máximo de GETs a S3 en vuelo, compartido por todas las consultas del proceso:
+# evita saturar un mismo prefijo y provocar respuestas 503 SlowDown.
+S3_MAX_CONCURRENT_DOWNLOADS = int(os.getenv("S3_MAX_CONCURRENT_DOWNLOADS", "16"))
+_S3_SLOTS = threading.BoundedSemaphore(max(1, S3_MAX_CONCURRENT_DOWNLOADS))
+# Vigencia (segundos) de los listados de prefijos cacheados por el cliente S3 (0 = sin caché).
+# Los prefijos del día UTC en curso (o posteriores) siguen recibiendo archivos y siempre se listan de nuevo.
+S3_LISTINGS_EXPIRY_SECONDS = int(os.getenv("S3_LISTINGS_EXPIRY_SECONDS", "300"))
+# Intervalo mínimo (segundos) entre escrituras de progreso en la DB; lo usan
+# también las etapas locales de recover.py
+PROGRESS_UPDATE_INTERVAL_SECONDS = float(os.getenv("PROGRESS_UPDATE_INTERVAL_SECONDS", "0.5"))
+# Hedging: si un GET supera el plazo (máx. entre el mínimo y 2x la media móvil de
+# duraciones), se lanza un segundo GET del mismo objeto y se usa el primero que termine.
+S3_HEDGE_ENABLED = os.getenv("S3_HEDGE_ENABLED", "1") not in ("0", "false", "False")
+S3_HEDGE_MIN_SECONDS = float(os.getenv("S3_HEDGE_MIN_SECONDS", "2"))
+S3_HEDGE_FACTOR = 2.0
+_S3_EWMA_ALPHA = 0.2
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    """Pool (perezoso) donde corren los GETs con hedging; acotado por los cupos de _S3_SLOTS."""
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=2 * max(1, S3_MAX_CONCURRENT_DOWNLOADS), thread_name_prefix="s3-get")
+        return _hedge_pool
+
+
+def _get_liberando_cupo(s3_client, archivo_remoto_s3: str, ruta_local: Path) -> None:
+    """GET a un archivo local; libera el cupo de _S3_SLOTS tomado por quien lo agendó."""
+    try:
+        s3_client.get(archivo_remoto_s3, str(ruta_local))
+    finally:
+        _S3_SLOTS.release()
+
+
+def _borrar_temporal(ruta: Path) -> None:
+    try:
+        ruta.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _es_404_de_s3(error: FileNotFoundError) -> bool:
+    """
+    True si el FileNotFoundError viene de un 404/NoSuchKey de S3. s3fs y fsspec los
+    construyen solo con un mensaje (sin errno); los del sistema de archivos local
+    (destino borrado, temporal .partN ausente) traen errno ENOENT y se reintentan.
+    """
+    causa = getattr(error.__cause__, "response", None)
+    if isinstance(causa, dict):
+        return causa.get("Error", {}).get("Code") in ("404", "NoSuchKey")
+    return error.errno is None
+
+
+def _ts_de_nombre(ruta: str) -> Optional[str]:
+    """
+    'YYYYJJJHHMM' del nombre GOES (..._sYYYYJJJHHMMSSS_e..._c....nc) de una ruta S3.
+    El nombre tiene estructura fija: se busca '_s' solo en el basename y se leen
+    11 caracteres a partir de ahí. None si no tiene timestamp.
+    """
+    nombre = ruta.rsplit('/', 1)[-1]
+    i = nombre.find('_s')
+    if i < 0:
+        return None
+    ts = nombre[i + 2:i + 13]
+    return ts if len(ts) == 11 and ts.isdigit() else None
+
+
+# Producto, banda y escaneo de un NetCDF GOES, tanto en S3 como extraído de Lustre:
+# 'OR_ABI-L2-CMIPF-M6C13_G16_s20233001200...', 'OR_ABI-L2-ACHAF-M6_GEAST_s20233001200...'
+_CLAVE_COBERTURA_RE = re.compile(r'-(L1b|L2)-([A-Za-z0-9]+?)-M\d(?:C(\d{2}))?_[^_/]+_s(\d{11})', re.IGNORECASE)
+
+
+def clave_cobertura(nombre: str) -> Optional[tuple]:
+    """
+    (nivel, producto, banda, escaneo) de un NetCDF GOES, p. ej. ('L2', 'CMIPF', '13',
+    '20233001200'); banda es None en productos sin banda (ACHA...). Nivel y producto
+    van en mayúsculas porque Lustre y S3 no coinciden ('L1B' / 'L1b'). None si el
+    nombre no sigue el patrón.
+    """
+    m = _CLAVE_COBERTURA_RE.search(nombre.rsplit('/', 1)[-1])
+    if m is None:
+        return None
+    return m.group(1).upper(), m.group(2).upper(), m.group(3), m.group(4)
+
+
+@lru_cache(maxsize=4096)
+def _fecha_a_juliana(fecha: str) -> tuple:
+    """
+    ('YYYY', 'JJJ') a partir de una clave 'YYYYMMDD' o 'YYYYJJJ', sin strptime.
+    Lanza ValueError si el formato o la fecha no son válidos.
+    """
+    if not fecha.isdigit():
+        raise ValueError(f"Formato de fecha no soportado: {fecha}")
+    if len(fecha) == 8:  # YYYYMMDD
+        dia = datetime(int(fecha[:4]), int(fecha[4:6]), int(fecha[6:8])).timetuple().tm_yday
+        return fecha[:4], f"{dia:03d}"
+    if len(fecha) == 7:  # YYYYJJJ
+        return fecha[:4], fecha[4:]
+    raise ValueError(f"Formato de fecha no soportado: {fecha}")
+
+
+@lru_cache(maxsize=4096)
+def parse_fecha_juliana(fecha_jjj: str) -> datetime:
+    """
+    Convierte 'YYYYJJJ' o 'YYYYJJJHHMM' en datetime sin strptime (mucho más lento).
+    Lanza ValueError si no es válida, igual que strptime. Se cachea porque muchos
+    archivos de una consulta comparten fecha y timestamp.
+    """
+    if len(fecha_jjj) not in (7, 11) or not fecha_jjj.isdigit() or not 1 <= int(fecha_jjj[4:7]) <= 366:
+        raise ValueError(f"Fecha juliana inválida: {fecha_jjj}")
+    hora, minuto = (int(fecha_jjj[7:9]), int(fecha_jjj[9:11])) if len(fecha_jjj) == 11 else (0, 0)
+    base = datetime(int(fecha_jjj[:4]), 1, 1, hora, minuto)
+    resultado = base + timedelta(days=int(fecha_jjj[4:7]) - 1)
+    if resultado.year != base.year:
+        raise ValueError(f"Día juliano fuera del año: {fecha_jjj}")
+    return resultado
+
+
+@lru_cache(maxsize=1024)
+def _sat_code_for_date(satellite_name: str, request_date: datetime, goes19_operational_date: datetime) -> str:
+    """Código de satélite (G16/G18/G19...) para una fecha; cacheado porque se repite entre consultas."""
+    if request_date.tzinfo is None:
+        request_date = request_date.replace(tzinfo=timezone.utc)
+    if satellite_name == "GOES-EAST":
+        return "G19" if request_date >= goes19_operational_date else "G16"
+    if satellite_name == "GOES-WEST":
+        return "G18"
+    if '-' in satellite_name:
+        return f"G{satellite_name.split('-')[-1]}"
+    return satellite_name
 
 
 class S3RecoverFiles:
@@ -12,17 +154,26 @@ class S3RecoverFiles:
         self.max_workers = max_workers
         self.retry_attempts = retry_attempts
         self.retry_backoff = retry_backoff
+        # Media móvil exponencial de la duración de los GETs (segundos), para el plazo de hedging
+        self._ewma_get_s = None
+        self._ewma_lock = threading.Lock()
+        # Cliente S3 perezoso, compartido por todas las consultas de esta instancia
+        self._s3_client = None
+        self._s3_client_lock = threading.Lock()
+
+    def _config_botocore(self) -> Dict:
+        """
+        Configuración del cliente S3: modo de reintentos 'adaptive' de botocore, que
+        además de reintentar limita la tasa del cliente (token bucket) ante throttling.
+        """
+        return {
+            'connect_timeout': 10,
+            'read_timeout': 30,
+            'retries': {'max_attempts': self.retry_attempts, 'mode': 'adaptive'},
+        }
 
     def get_sat_code_for_date(self, satellite_name: str, request_date: datetime, goes19_operational_date: datetime) -> str:
-        if request_date.tzinfo is None:
-            request_date = request_date.replace(tzinfo=timezone.utc)
-        if satellite_name == "GOES-EAST":
-            return "G19" if request_date >= goes19_operational_date else "G16"
-        if satellite_name == "GOES-WEST":
-            return "G18"
-        if '-' in satellite_name:
-            return f"G{satellite_name.split('-')[-1]}"
-        return satellite_name
+        return _sat_code_for_date(satellite_name, request_date, goes19_operational_date)
 
     def get_s3_product_names(self, query_dict: Dict) -> List[str]:
         sensor = query_dict.get('sensor', 'abi').upper()
@@ -37,98 +188,144 @@ class S3RecoverFiles:
             return [f"{sensor}-{nivel}-{prod}{s3_domain_code}" for prod in query_dict['productos']]
         return [f"{sensor}-{nivel}-RadF"]
 
-    def discover_files(self, query_dict: Dict, goes19_operational_date: datetime) -> Dict[str, str]:
+    def _get_s3(self) -> s3fs.S3FileSystem:
+        """Crea el S3FileSystem una sola vez (sesión botocore, credenciales, config) y lo reutiliza."""
+        if self._s3_client is None:
+            with self._s3_client_lock:
+                if self._s3_client is None:
+                    if S3_LISTINGS_EXPIRY_SECONDS > 0:
+                        opciones = {'use_listings_cache': True, 'listings_expiry_time': S3_LISTINGS_EXPIRY_SECONDS}
+                    else:
+                        opciones = {'use_listings_cache': False}
+                    self._s3_client = s3fs.S3FileSystem(anon=True, config_kwargs=self._config_botocore(), **opciones)
+        return self._s3_client
+
+    def discover_files(
+        self,
+        query_dict: Dict,
+        goes19_operational_date: datetime,
+        *,
+        claves_cubiertas: AbstractSet[tuple] = frozenset(),
+        escaneos_completos: AbstractSet[str] = frozenset(),
+    ) -> Dict[str, str]:
+        """
+        {nombre: ruta S3} de los NetCDF que pide la consulta. Se omiten los ya
+        recuperados por otra fuente: claves_cubiertas son claves de clave_cobertura()
+        y escaneos_completos, escaneos 'YYYYJJJHHMM' cuyo contenido ya está completo.
+        """
         sat_name = query_dict.get('satelite', 'GOES-16')
         first_day_jjj = next(iter(query_dict.get('fechas', {})), None)
-        request_date = datetime.strptime(first_day_jjj, '%Y%j') if first_day_jjj else datetime.now()
+        request_date = parse_fecha_juliana(first_day_jjj) if first_day_jjj else datetime.now()
         sat_code = self.get_sat_code_for_date(sat_name, request_date, goes19_operational_date)
         s3_bucket = f"noaa-goes{sat_code.replace('G', '')}"
         s3_product_names = self.get_s3_product_names(query_dict)
-        s3 = s3fs.S3FileSystem(anon=True, config_kwargs={'connect_timeout': 10, 'read_timeout': 30})  # <-- AGREGA ESTA LÍNEA
+        s3 = self._get_s3()
         objetivos_s3_a_descargar = set()
         bandas_solicitadas = query_dict.get('bandas')
-        # ...resto del método...
+        bandas_solicitadas_str = [str(b) for b in bandas_solicitadas] if bandas_solicitadas else []
+        # Política de bandas por producto: en L2 solo los CMI* filtran por banda
+        # (ACHA y otros la ignoran); en L1b siempre se filtra. Así basta una sola
+        # llamada para consultas que mezclan ambos tipos de producto.
+        productos_req = query_dict.get('productos') or []
+        if query_dict.get('nivel') == 'L2' and productos_req:
+            requiere_bandas = [str(prod).strip().upper().startswith('CMI') for prod in productos_req]
+        else:
+            requiere_bandas = [True] * len(s3_product_names)
+        productos_s3 = list(zip(s3_product_names, requiere_bandas))
+        # Lo ya recuperado no se descarga de nuevo. Las horas se siguen listando:
+        # pueden tener otros escaneos, productos o bandas.
+        hoy_utc = datetime.now(timezone.utc).strftime('%Y%j')
         for fecha_jjj, horarios_list in query_dict.get('fechas', {}).items():
             # Permitir tanto YYYYMMDD como YYYYJJJ
-            if len(fecha_jjj) == 8:  # YYYYMMDD
-                dt = datetime.strptime(fecha_jjj, "%Y%m%d")
-                anio = dt.strftime("%Y")
-                dia_juliano = dt.strftime("%j")  # Siempre 3 dígitos
-            elif len(fecha_jjj) == 7:  # YYYYJJJ
-                anio = fecha_jjj[:4]
-                dia_juliano = fecha_jjj[4:].zfill(3)
-            else:
-                raise ValueError(f"Formato de fecha no soportado: {fecha_jjj}")
+            anio, dia_juliano = _fecha_a_juliana(fecha_jjj)
+            # Un día que aún no termina puede tener archivos nuevos: su listado no sale de la caché
+            dia_reciente = f"{anio}{dia_juliano}" >= hoy_utc
             
+            # Un solo LIST por (producto, día, hora): rangos como "12:00-12:30" y "12:45-13:10"
+            # comparten el prefijo de las 12h, y el filtrado por minuto usa todos los rangos.
+            horas_dia = set()
             for horario_str in horarios_list:
                 inicio_hh = int(horario_str.split(':')[0])
                 fin_hh = int(horario_str.split('-')[1].split(':')[0]) if '-' in horario_str else inicio_hh
-                for hora in range(inicio_hh, fin_hh + 1):
-                    for s3_product_name in s3_product_names:
-                        s3_path_hora = f"{s3_bucket}/{s3_product_name}/{anio}/{dia_juliano}/{hora:02d}/"
-                        try:
-                            archivos_en_hora = s3.ls(s3_path_hora)
-                            archivos_nc = [f for f in archivos_en_hora if f.endswith('.nc')]
-                            bandas_solicitadas = query_dict.get('bandas')
-                            if bandas_solicitadas:
-                                bandas_solicitadas_str = [str(b) for b in bandas_solicitadas]
-                                archivos_nc = [
-                                    f for f in archivos_nc
-                                    if any(f"C{b}" in f for b in bandas_solicitadas_str)
-                                ]
+                horas_dia.update(range(inicio_hh, fin_hh + 1))
+            for hora in sorted(horas_dia):
+                for s3_product_name, filtrar_bandas in productos_s3:
+                    s3_path_hora = f"{s3_bucket}/{s3_product_name}/{anio}/{dia_juliano}/{hora:02d}/"
+                    try:
+                        archivos_en_hora = s3.ls(s3_path_hora, refresh=True) if dia_reciente else s3.ls(s3_path_hora)
+                        archivos_nc = [f for f in archivos_en_hora if f.endswith('.nc')]
+                        if filtrar_bandas and bandas_solicitadas_str:
+                            # La banda ('C13') se busca solo en el nombre, no en la ruta completa
+                            archivos_nc = [
+                                f for f in archivos_nc
+                                if any(f"C{b}" in f.rsplit('/', 1)[-1] for b in bandas_solicitadas_str)
+                            ]
 
-                            archivos_filtrados = self.filter_files_by_time(archivos_nc, f"{anio}{dia_juliano}", horarios_list)
+                        archivos_filtrados = self.filter_files_by_time(archivos_nc, f"{anio}{dia_juliano}", horarios_list)
+                        if escaneos_completos:
+                            archivos_filtrados = [f for f in archivos_filtrados if _ts_de_nombre(f) not in escaneos_completos]
+                        if claves_cubiertas:
+                            archivos_filtrados = [f for f in archivos_filtrados if clave_cobertura(f) not in claves_cubiertas]
 
-                            objetivos_s3_a_descargar.update(archivos_filtrados)
-                        except FileNotFoundError:
-                            continue
+                        objetivos_s3_a_descargar.update(archivos_filtrados)
+                    except FileNotFoundError:
+                        continue
 
-        return {Path(f).name: f for f in objetivos_s3_a_descargar}
+        # Orden por clave: las descargas recorren cada prefijo producto/día/hora de forma contigua
+        return {Path(f).name: f for f in sorted(objetivos_s3_a_descargar)}
 
 
     def download_files(self, consulta_id: str, archivos_s3: List[str], directorio_destino: Path, db) -> (List[Path], List[str]):
-        s3 = s3fs.S3FileSystem(anon=True, config_kwargs={'connect_timeout': 10, 'read_timeout': 30})
+        s3 = self._get_s3()
         objetivos_aun_fallidos = []
         s3_recuperados_set = set()
 
-        # Normalizar objetivos únicos
-        objetivos_unicos = list(set(archivos_s3))
+        # Normalizar objetivos únicos conservando el orden (agrupado por prefijo)
+        objetivos_unicos = list(dict.fromkeys(archivos_s3))
         total_obj = len(objetivos_unicos) or 1
 
+        # Un solo listado del destino: sirve para saber qué objetivos ya existen (tras un
+        # reinicio) y para contar los .nc presentes, sin exists()/stat() por objetivo.
+        try:
+            with os.scandir(directorio_destino) as entradas:
+                presentes = {e.name: e for e in entradas if e.is_file()}
+            local_nc_count = sum(1 for nombre in presentes if nombre.endswith('.nc'))
+        except OSError:
+            presentes = {}
+            local_nc_count = None
+
         # Pre-contar archivos ya existentes para reflejar progreso real tras reinicio
         existentes = []
         pendientes = []
         for s3_path in objetivos_unicos:
-            nombre_local = Path(s3_path).name
-            ruta_local = directorio_destino / nombre_local
+            nombre_local = s3_path.rsplit('/', 1)[-1]
+            entrada = presentes.get(nombre_local)
             try:
-                if ruta_local.exists() and ruta_local.stat().st_size > 0:
+                if entrada is not None and entrada.stat().st_size > 0:
                     existentes.append(s3_path)
-                    s3_recuperados_set.add(ruta_local)
+                    s3_recuperados_set.add(directorio_destino / nombre_local)
                 else:
                     pendientes.append(s3_path)
             except OSError:
                 pendientes.append(s3_path)
-
-        # Contabilizar archivos .nc presentes en el directorio para reflejar progreso real
-        try:
-            local_nc_count = sum(1 for p in directorio_destino.iterdir() if p.is_file() and str(p).endswith('.nc'))
-        except Exception:
+        if local_nc_count is None:
             local_nc_count = len(existentes)
 
         # Usar el mayor entre los que coinciden con objetivos y los .nc locales, pero sin exceder total_obj
         completados = min(max(len(existentes), local_nc_count), total_obj)
-        update_every = 100  # Fijo: actualizar progreso cada 100 archivos
+        # El progreso de S3 solo ocupa 85-95: escribir en DB únicamente cuando cambia
+        # el porcentaje y pasó PROGRESS_UPDATE_INTERVAL_SECONDS (la última siempre se escribe).
+        ultima_escritura = time.monotonic()
         ok_count = len(existentes)
         fail_count = 0
 
         # Publicar un estado inicial con el progreso basado en archivos ya presentes
+        ultimo_progreso = 85 + int((completados / total_obj) * 10)
         if db:
-            progreso_inicial = 85 + int((completados / total_obj) * 10)
             db.actualizar_estado(
                 consulta_id,
                 "procesando",
-                progreso_inicial,
+                ultimo_progreso,
                 f"S3 progreso: {completados}/{total_obj}"
             )
 
@@ -154,9 +351,15 @@ class S3RecoverFiles:
                     fail_count += 1
                 finally:
                     completados = min(completados + 1, total_obj)
-                    if db and (completados % update_every == 0 or completados == total_obj):
-                        # Mapear progreso de 85 a 95 proporcional a descargas S3
-                        progreso = 85 + int((completados / total_obj) * 10)
+                    # Mapear progreso de 85 a 95 proporcional a descargas S3
+                    progreso = 85 + int((completados / total_obj) * 10)
+                    ahora = time.monotonic()
+                    if db and (completados == total_obj or (
+                        progreso != ultimo_progreso
+                        and ahora - ultima_escritura >= PROGRESS_UPDATE_INTERVAL_SECONDS
+                    )):
+                        ultima_escritura = ahora
+                        ultimo_progreso = progreso
                         db.actualizar_estado(
                             consulta_id,
                             "procesando",
@@ -181,49 +384,107 @@ class S3RecoverFiles:
                 ruta_local_destino = directorio_destino / nombre_archivo_local
                 # Idempotencia: si el archivo ya existe, omitir descarga
                 try:
-                    if ruta_local_destino.exists() and ruta_local_destino.stat().st_size > 0:
+                    if ruta_local_destino.stat().st_size > 0:
                         return ruta_local_destino
                 except OSError:
                     pass
                 # Reducir ruido: no actualizar DB por cada intento/archivo; el progreso se reporta en bloque.
-                s3_client.get(archivo_remoto_s3, str(ruta_local_destino))
+                self._get_con_hedging(s3_client, archivo_remoto_s3, ruta_local_destino)
                 return ruta_local_destino
             except Exception as e:
+                if isinstance(e, FileNotFoundError) and _es_404_de_s3(e):
+                    # 404/NoSuchKey no se resuelve reintentando: fallar de inmediato (cuenta como fallo)
+                    self.logger.error(f"❌ El archivo {archivo_remoto_s3} no existe en S3.")
+                    raise
                 last_exception = e
                 # Reducir ruido: registrar intentos a nivel debug
                 self.logger.debug(f"Intento {attempt + 1}/{self.retry_attempts} falló para {archivo_remoto_s3}: {e}")
                 if attempt < self.retry_attempts - 1:
-                    wait_time = self.retry_backoff * (2 ** attempt)
+                    # Backoff exponencial con jitter completo para no sincronizar reintentos entre hilos
+                    wait_time = random.uniform(0, min(S3_RETRY_BACKOFF_CAP_SECONDS, self.retry_backoff * (2 ** attempt)))
                     time.sleep(wait_time)
         self.logger.error(f"❌ Fallaron todos los {self.retry_attempts} intentos para descargar desde S3 el archivo {archivo_remoto_s3}.")
         if last_exception:
             raise last_exception
         return None
 
+    def _tomar_cupo(self, nombre: str) -> None:
+        if not _S3_SLOTS.acquire(blocking=False):
+            self.logger.debug(f"S3: esperando un cupo de descarga ({S3_MAX_CONCURRENT_DOWNLOADS} en vuelo) para {nombre}")
+            _S3_SLOTS.acquire()
+
+    def _registrar_duracion(self, segundos: float) -> None:
+        with self._ewma_lock:
+            if self._ewma_get_s is None:
+                self._ewma_get_s = segundos
+            else:
+                self._ewma_get_s += _S3_EWMA_ALPHA * (segundos - self._ewma_get_s)
+
+    def _plazo_hedge(self) -> Optional[float]:
+        """Plazo para lanzar el GET de respaldo; None sin hedging o sin muestras todavía."""
+        if not S3_HEDGE_ENABLED or self._ewma_get_s is None:
+            return None
+        return max(S3_HEDGE_MIN_SECONDS, S3_HEDGE_FACTOR * self._ewma_get_s)
+
+    def _get_con_hedging(self, s3_client, archivo_remoto_s3: str, ruta_local_destino: Path) -> None:
+        """
+        Descarga un objeto respetando el límite de GETs en vuelo. Si excede el plazo de
+        hedging y hay cupo libre, lanza un segundo GET a otro archivo temporal; el primero
+        que termine bien se mueve al destino con os.replace y el temporal del otro se borra.
+        """
+        self._tomar_cupo(ruta_local_destino.name)
+        inicio = time.monotonic()
+        plazo = self._plazo_hedge()
+        if plazo is None:
+            _get_liberando_cupo(s3_client, archivo_remoto_s3, ruta_local_destino)
+            self._registrar_duracion(time.monotonic() - inicio)
+            return
+
+        pool = _get_hedge_pool()
+        # Temporales ocultos: no cuentan como .nc en el destino mientras se descargan
+        tmp_primario = ruta_local_destino.with_name(f".{ruta_local_destino.name}.part0")
+        tmp_respaldo = ruta_local_destino.with_name(f".{ruta_local_destino.name}.part1")
+        primario = pool.submit(_get_liberando_cupo, s3_client, archivo_remoto_s3, tmp_primario)
+        temporales = {primario: tmp_primario}
+        hechos, _ = wait([primario], timeout=plazo)
+        if not hechos and _S3_SLOTS.acquire(blocking=False):
+            self.logger.debug(f"S3: GET lento (> {plazo:.1f}s), lanzando GET de respaldo para {ruta_local_destino.name}")
+            respaldo = pool.submit(_get_liberando_cupo, s3_client, archivo_remoto_s3, tmp_respaldo)
+            temporales[respaldo] = tmp_respaldo
+
+        pendientes = set(temporales)
+        ganador = None
+        while pendientes and ganador is None:
+            hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                if futuro.exception() is None and ganador is None:
+                    ganador = futuro
+                else:
+                    _borrar_temporal(temporales[futuro])
+        # El perdedor no se puede interrumpir: su temporal se borra cuando termine.
+        for futuro in pendientes:
+            futuro.add_done_callback(lambda f, ruta=temporales[futuro]: _borrar_temporal(ruta))
+        if ganador is None:
+            raise primario.exception()
+        os.replace(temporales[ganador], ruta_local_destino)
+        self._registrar_duracion(time.monotonic() - inicio)
+
     def filter_files_by_time(self, archivos_nc: list, fecha_jjj: str, horarios_list: list) -> list:
+        # Rangos en minutos calculados una vez; el timestamp se lee a offsets fijos del basename.
+        rangos = []
+        for horario_str in horarios_list:
+            partes = horario_str.split('-')
+            inicio = partes[0]
+            fin = partes[1] if len(partes) > 1 else inicio
+            rangos.append((int(inicio[:2]) * 60 + int(inicio[3:5]), int(fin[:2]) * 60 + int(fin[3:5])))
         archivos_filtrados = []
         for archivo in archivos_nc:
             nombre = archivo.name if hasattr(archivo, "name") else archivo
-            s_idx = nombre.find('_s')
-            e_idx = nombre.find('_e')
-            if s_idx == -1 or e_idx == -1:
-                continue
-            ts_str = nombre[s_idx+2:e_idx]
-            if len(ts_str) < 11:
+            ts = _ts_de_nombre(nombre)
+            if ts is None or ts[:7] != fecha_jjj:
                 continue
-            anio = ts_str[:4]
-            dia_juliano = ts_str[4:7]
-            hora = ts_str[7:9]
-            minuto = ts_str[9:11]
-            if anio + dia_juliano != fecha_jjj:
-                continue
-            archivo_hm = int(hora) * 60 + int(minuto)
-            for horario_str in horarios_list:
-                partes = horario_str.split('-')
-                inicio = partes[0]
-                fin = partes[1] if len(partes) > 1 else inicio
-                inicio_hm = int(inicio[:2]) * 60 + int(inicio[3:5])
-                fin_hm = int(fin[:2]) * 60 + int(fin[3:5])
+            archivo_hm = int(ts[7:9]) * 60 + int(ts[9:11])
+            for inicio_hm, fin_hm in rangos:
                 if inicio_hm <= archivo_hm <= fin_hm:
                     archivos_filtrados.append(archivo)
                     break
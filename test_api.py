@@ -3,9 +3,12 @@ from fastapi.testclient import TestClient
 import main  # Importamos el módulo principal
 import time
 import re
+import gzip
+import json
 from background_simulator import BackgroundSimulator
 from database import ConsultasDatabase
 import os
+from pathlib import Path
 from recover import RecoverFiles  # Importar el procesador real para la prueba de integración
 
 # --- Configuración de la Base de Datos de Prueba ---
@@ -86,6 +89,56 @@ def test_validate_success():
     assert data["resumen_solicitud"]["satelite"] == "GOES-16"
     assert data["resumen_solicitud"]["total_fechas_expandidas"] == 3
 
+def test_validate_accepts_gzip_body():
+    """Prueba que el servidor acepta cuerpos JSON comprimidos con Content-Encoding: gzip."""
+    body = gzip.compress(json.dumps(VALID_REQUEST).encode())
+    response = client.post(
+        "/validate",
+        content=body,
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+    assert response.json()["success"] is True
+
+def test_validate_rejects_invalid_gzip_body():
+    """Prueba que un cuerpo marcado como gzip pero corrupto devuelve 400."""
+    response = client.post(
+        "/validate",
+        content=b"no es gzip",
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 400
+
+def test_validate_rejects_truncated_gzip_body():
+    """Prueba que un gzip truncado devuelve 400."""
+    body = gzip.compress(json.dumps(VALID_REQUEST).encode())
+    response = client.post(
+        "/validate",
+        content=body[:-8],
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 400
+
+def test_validate_rejects_gzip_bomb(monkeypatch):
+    """Prueba que un gzip que se infla por encima del límite devuelve 413 sin descomprimirlo completo."""
+    monkeypatch.setattr(main, "MAX_DECOMPRESSED_BODY_BYTES", 1024)
+    response = client.post(
+        "/validate",
+        content=gzip.compress(b" " * (10 * 1024 * 1024)),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 413
+
+def test_validate_rejects_oversized_gzip_body(monkeypatch):
+    """Prueba que un cuerpo comprimido mayor que MAX_GZIP_BODY_BYTES devuelve 413."""
+    monkeypatch.setattr(main, "MAX_GZIP_BODY_BYTES", 16)
+    response = client.post(
+        "/validate",
+        content=gzip.compress(json.dumps(VALID_REQUEST).encode()),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 413
+
 def test_validate_invalid_satellite():
     """Prueba que una solicitud con un satélite no soportado falla."""
     response = client.post("/validate", json=INVALID_SATELLITE_REQUEST)
@@ -136,6 +189,22 @@ def test_query_success(monkeypatch):
     assert data["consulta_id"] == "TEST_SUCCESS"
     assert data["resumen"]["satelite"] == "GOES-16"
 
+def test_query_with_validate_includes_validation_summary(monkeypatch):
+    """Prueba que /query?validate=1 crea la consulta y devuelve el resumen de /validate."""
+    monkeypatch.setattr("main.generar_id_consulta", lambda: "TEST_QUERY_VALIDATE")
+
+    response = client.post("/query?validate=1", json=VALID_REQUEST)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["consulta_id"] == "TEST_QUERY_VALIDATE"
+    assert data["validation"]["success"] is True
+    assert data["validation"]["resumen_solicitud"] == client.post("/validate", json=VALID_REQUEST).json()["resumen_solicitud"]
+
+def test_query_with_validate_rejects_invalid_request():
+    """Prueba que /query?validate=1 responde 400 sin crear la consulta si la solicitud es inválida."""
+    response = client.post("/query?validate=1", json=INVALID_BAND_REQUEST)
+    assert response.status_code == 400
+
 def test_internal_date_format_is_julian(monkeypatch):
     """Verifica que el formato de fecha interno en la DB es YYYYJJJ."""
     TEST_ID = "TEST_JULIAN_DATE"
@@ -204,6 +273,77 @@ def test_get_nonexistent_query():
     assert response.status_code == 404
     assert response.json()["detail"] == "Consulta no encontrada"
 
+def test_get_query_long_poll_returns_after_wait_without_changes():
+    """Prueba que ?wait=N devuelve el estado actual si la consulta no cambia en N segundos."""
+    TEST_ID = "TEST_LONG_POLL"
+    assert main.db.crear_consulta(TEST_ID, {"satelite": "GOES-16"})
+
+    start = time.monotonic()
+    response = client.get(f"/query/{TEST_ID}?wait=1")
+    elapsed = time.monotonic() - start
+
+    assert response.status_code == 200
+    assert response.json()["estado"] == "recibido"
+    assert elapsed >= 0.9
+
+def test_query_events_stream_ends_with_completed_event():
+    """Prueba que /query/{id}/events emite el evento final 'completed' de una consulta terminada."""
+    TEST_ID = "TEST_SSE"
+    assert main.db.crear_consulta(TEST_ID, {"satelite": "GOES-16"})
+    main.db.actualizar_estado(TEST_ID, "completado", 100, "Listo")
+
+    response = client.get(f"/query/{TEST_ID}/events")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    lineas = response.text.strip().splitlines()
+    assert lineas[0] == "event: completed"
+    assert '"estado": "completado"' in lineas[1]
+
+def test_query_events_nonexistent_query():
+    """Prueba que el stream de eventos de una consulta inexistente devuelve 404."""
+    response = client.get("/query/ID_FALSO_123/events")
+    assert response.status_code == 404
+
+def test_query_events_stream_ends_when_query_is_deleted(monkeypatch):
+    """Si la consulta desaparece a mitad del stream, se emite un evento 'error' y el stream termina."""
+    TEST_ID = "TEST_SSE_DELETED"
+    assert main.db.crear_consulta(TEST_ID, {"satelite": "GOES-16"})
+    main.db.actualizar_estado(TEST_ID, "procesando", 10, "Trabajando")
+    monkeypatch.setattr(main, "LONG_POLL_TICK_SECONDS", 0.01)
+    obtener_original = main.db.obtener_consulta
+    llamadas = []
+
+    def obtener_y_luego_borrada(consulta_id):
+        llamadas.append(consulta_id)
+        return obtener_original(consulta_id) if len(llamadas) == 1 else None
+
+    monkeypatch.setattr(main.db, "obtener_consulta", obtener_y_luego_borrada)
+    response = client.get(f"/query/{TEST_ID}/events")
+    assert response.status_code == 200
+    lineas = response.text.strip().splitlines()
+    assert lineas[0] == "event: estado"
+    assert lineas[-2] == "event: error"
+    assert json.loads(lineas[-1][len("data: "):]) == {"consulta_id": TEST_ID, "detail": "Consulta no encontrada"}
+
+def test_gzip_middleware_never_compresses_event_streams():
+    """Los streams /events no se comprimen aunque el cliente acepte gzip; las demás rutas sí."""
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse, StreamingResponse
+    from starlette.routing import Route
+
+    async def eventos(request):
+        return StreamingResponse(iter(["event: estado\ndata: {}\n\n"]), media_type="text/plain")
+
+    async def texto(request):
+        return PlainTextResponse("x" * 100)
+
+    app = Starlette(routes=[Route("/query/X/events", eventos), Route("/query/X", texto)])
+    app.add_middleware(main.GZipSalvoEventosMiddleware, minimum_size=1)
+    with TestClient(app) as cliente:
+        encabezados = {"Accept-Encoding": "gzip"}
+        assert "content-encoding" not in cliente.get("/query/X/events", headers=encabezados).headers
+        assert cliente.get("/query/X", headers=encabezados).headers["content-encoding"] == "gzip"
+
 def test_list_queries():
     """Prueba que el endpoint de listado funciona y devuelve una lista."""
     response = client.get("/queries")
@@ -304,6 +444,83 @@ def test_simulator_report_has_correct_sources_structure(monkeypatch):
     assert resultados["total_archivos"] == fuentes["lustre"]["total"] + fuentes["s3"]["total"]
 
 
+# --- Pruebas de RecoverFiles con fuentes simuladas (sin I/O real) ---
+
+# L2 con un producto explícito: sin 'productos' la etapa S3 no consulta nada.
+RECOVER_REQUEST = {**VALID_REQUEST, "productos": ["CMIP"]}
+
+# Archivo S3 dentro de la primera fecha/horario de VALID_REQUEST: 20231026 (juliano 299), 00:00-01:00.
+S3_NOMBRE = "OR_ABI-L2-CMIPF-M6C13_G16_s20232990000207_e20232990009515_c20232990009588.nc"
+S3_CLAVE = f"noaa-goes16/ABI-L2-CMIPF/2023/299/00/{S3_NOMBRE}"
+
+# (nombre, parches, descargas S3 esperadas, total lustre, total s3)
+SCENARIOS = [
+    # Recuperación exitosa solo desde Lustre/local.
+    ("local", {
+        "recover.LustreRecoverFiles.discover_and_filter_files": lambda self, q: [Path("/tmp/fake1.tgz")],
+        "recover.LustreRecoverFiles.scan_existing_files": lambda self, files, dest: files,
+        "recover._process_safe_recover_file": lambda *a, **kw: [Path("/tmp/fake1.tgz")],
+        "recover.S3RecoverFiles.discover_files": lambda *a, **kw: {},
+    }, [], 1, 0),
+    # Recuperación exitosa solo desde S3.
+    ("s3", {
+        "recover.LustreRecoverFiles.discover_and_filter_files": lambda self, q: [],
+        "recover.S3RecoverFiles.discover_files": lambda self, q, d, **kw: {S3_NOMBRE: S3_CLAVE},
+    }, [S3_CLAVE], 0, 1),
+    # Recuperación mixta: un archivo local, otro solo en S3.
+    ("mixed", {
+        "recover.LustreRecoverFiles.discover_and_filter_files": lambda self, q: [Path("/tmp/fake1.tgz"), Path("/tmp/fake2.tgz")],
+        "recover.LustreRecoverFiles.scan_existing_files": lambda self, files, dest: [Path("/tmp/fake1.tgz")],
+        "recover._process_safe_recover_file": lambda *a, **kw: [Path("/tmp/fake1.tgz")],
+        "recover.S3RecoverFiles.discover_files": lambda self, q, d, **kw: {S3_NOMBRE: S3_CLAVE},
+    }, [S3_CLAVE], 1, 1),
+]
+
+def _esperar_estado_final(consulta_id: str, intentos: int = 10) -> str:
+    """Lee el estado directamente de la DB de prueba hasta que la consulta termine."""
+    for _ in range(intentos):
+        estado = main.db.obtener_consulta(consulta_id)["estado"]
+        if estado in ("completado", "error"):
+            break
+        time.sleep(0.1)
+    return estado
+
+@pytest.mark.parametrize("name,patches,descargas,total_lustre,total_s3", SCENARIOS, ids=[s[0] for s in SCENARIOS])
+def test_query_recover_sources(monkeypatch, tmp_path, executor_inmediato, name, patches, descargas, total_lustre, total_s3):
+    """Simula recuperaciones local, S3 y mixta con RecoverFiles y verifica el conteo por fuente."""
+    for target, fake in patches.items():
+        monkeypatch.setattr(target, fake)
+    recibidos = []
+    def fake_download_files(self, cid, files, dest, db):
+        recibidos.extend(files)
+        return [Path(dest) / f.rsplit("/", 1)[-1] for f in files], []
+    monkeypatch.setattr("recover.S3RecoverFiles.download_files", fake_download_files)
+    monkeypatch.setattr(time, "sleep", lambda s: None)
+    monkeypatch.setattr(main, "recover", RecoverFiles(
+        db=main.db,
+        source_data_path=str(tmp_path / "lustre"),
+        base_download_path=str(tmp_path / "downloads"),
+        executor=executor_inmediato,
+        s3_fallback_enabled=True,
+        lustre_enabled=True,
+        max_workers=1,
+    ))
+    monkeypatch.setattr("main.generar_id_consulta", lambda: f"TEST_RECOVER_{name.upper()}")
+
+    response = client.post("/query", json=RECOVER_REQUEST)
+    assert response.status_code == 200
+    consulta_id = response.json()["consulta_id"]
+
+    assert _esperar_estado_final(consulta_id) == "completado"
+
+    assert recibidos == descargas
+    fuentes = main.db.obtener_consulta(consulta_id)["resultados"]["fuentes"]
+    assert fuentes["lustre"]["total"] == total_lustre
+    assert fuentes["s3"]["total"] == total_s3
+    if descargas:
+        assert fuentes["s3"]["archivos"] == [S3_NOMBRE]
+
+
 # --- Pruebas de Integración (I/O Real) ---
 
 @pytest.fixture
@@ -0,0 +1,294 @@
+import asyncio
+import gzip
+import json
+
+import httpx
+import pytest
+
+import api_client
+
+
+@pytest.fixture(autouse=True)
+def sin_esperas(monkeypatch):
+    """Los reintentos y sondeos del cliente no esperan de verdad en las pruebas."""
+    monkeypatch.setattr(api_client, "BACKOFF_REINTENTOS_SECONDS", 0)
+
+
+def _cliente(handler) -> httpx.Client:
+    """Cliente con el mismo transporte con reintentos que crear_sesion, sobre un MockTransport."""
+    transporte = api_client._TransporteConReintentos(httpx.MockTransport(handler))
+    return httpx.Client(base_url="http://api", transport=transporte)
+
+
+def test_session_retries_transient_status_codes():
+    """GET se reintenta ante 502/503/504 hasta obtener una respuesta definitiva."""
+    estados = iter([503, 502, 200])
+    llamadas = []
+
+    def handler(request):
+        llamadas.append(request.url.path)
+        return httpx.Response(next(estados), json={"ok": True})
+
+    with _cliente(handler) as session:
+        assert session.get("/query/X").status_code == 200
+    assert llamadas == ["/query/X"] * 3
+
+
+def test_session_does_not_retry_post_on_bad_gateway():
+    """Un POST que recibe 502 no se reenvía: el servidor pudo haber creado la consulta."""
+    llamadas = []
+
+    def handler(request):
+        llamadas.append(request.method)
+        return httpx.Response(502)
+
+    with _cliente(handler) as session:
+        assert session.post("/query", content=b"{}").status_code == 502
+    assert llamadas == ["POST"]
+
+
+def test_session_gives_up_after_max_retries():
+    llamadas = []
+
+    def handler(request):
+        llamadas.append(request.method)
+        return httpx.Response(503)
+
+    with _cliente(handler) as session:
+        assert session.get("/health").status_code == 503
+    assert len(llamadas) == api_client.MAX_REINTENTOS_ESTADO + 1
+
+
+def test_servidor_disponible_tolerates_slow_health():
+    """Un /health que excede el timeout no significa que el servidor esté caído."""
+    def handler(request):
+        raise httpx.ReadTimeout("lento", request=request)
+
+    with _cliente(handler) as session:
+        assert api_client.servidor_disponible(session, "http://api") is True
+
+
+def test_servidor_disponible_reports_connection_refused(capsys):
+    def handler(request):
+        raise httpx.ConnectError("rechazada", request=request)
+
+    with _cliente(handler) as session:
+        assert api_client.servidor_disponible(session, "http://api") is False
+    assert "No se pudo conectar" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("contenido", [b"\xff\xfe{no utf-8}", b"{incompleto"])
+def test_cargar_solicitud_reports_invalid_json_in_one_line(tmp_path, capsys, contenido):
+    ruta = tmp_path / "solicitud.json"
+    ruta.write_bytes(contenido)
+    assert api_client.cargar_solicitud(str(ruta)) is None
+    assert "no contiene un JSON válido" in capsys.readouterr().out
+
+
+def test_cargar_solicitud_reports_unreadable_path_in_one_line(tmp_path, capsys):
+    """Un directorio (o un archivo sin permisos) se reporta sin traceback."""
+    assert api_client.cargar_solicitud(str(tmp_path)) is None
+    assert "No se pudo leer el archivo" in capsys.readouterr().out
+
+
+def _respuesta_estado(estado, progreso):
+    return httpx.Response(200, json={"consulta_id": "X", "estado": estado, "progreso": progreso, "mensaje": ""})
+
+
+def _respuesta_resultados():
+    return httpx.Response(200, json={"consulta_id": "X", "estado": "completado", "resultados": {"total_archivos": 0}})
+
+
+def test_long_poll_pauses_when_server_ignores_wait(monkeypatch):
+    """
+    Contra un servidor que ignora `wait` y responde al instante, cada respuesta sin
+    cambios espera poll_interval; el bucle termina al llegar 'completado'.
+    """
+    estados = iter([("procesando", 10), ("procesando", 10), ("procesando", 10), ("completado", 100)])
+    esperas = []
+    monkeypatch.setattr(api_client.time, "sleep", esperas.append)
+
+    def handler(request):
+        if "resultados" in request.url.params:
+            return _respuesta_resultados()
+        assert request.url.params["wait"] == "30"
+        return _respuesta_estado(*next(estados))
+
+    with _cliente(handler) as session:
+        api_client.monitorear_consulta(session, "http://api", "X", timeout=60, poll_interval=7, long_poll_wait=30)
+    assert esperas == [7, 7]
+
+
+class _RespuestaEnTrozos:
+    """Respuesta mínima con iter_bytes() que entrega el cuerpo en trozos dados."""
+
+    def __init__(self, trozos):
+        self._trozos = trozos
+
+    def iter_bytes(self):
+        return iter(self._trozos)
+
+
+def test_lector_stream_reads_across_chunk_boundaries():
+    """read(n) devuelve exactamente n bytes aunque crucen trozos, y read() el resto."""
+    cuerpo = bytes(range(256)) * 40
+    trozos = [cuerpo[i:i + 1000] for i in range(0, len(cuerpo), 1000)]
+    lector = api_client._LectorStream(_RespuestaEnTrozos(trozos))
+
+    leido = [lector.read(7) for _ in range(300)]
+    assert all(len(parte) == 7 for parte in leido)
+    resto = lector.read()
+    assert b"".join(leido) + resto == cuerpo
+    assert lector.read(10) == b""
+
+
+def test_long_poll_stops_on_error_state_without_fetching_results(monkeypatch, capsys):
+    """Un estado 'error' termina el monitoreo y no se piden resultados."""
+    monkeypatch.setattr(api_client.time, "sleep", lambda segundos: None)
+    pedidos = []
+
+    def handler(request):
+        pedidos.append(str(request.url))
+        return _respuesta_estado("error", 0)
+
+    with _cliente(handler) as session:
+        api_client.monitorear_consulta(session, "http://api", "X", timeout=60, poll_interval=1, long_poll_wait=30)
+    assert pedidos == ["http://api/query/X?wait=30"]
+    assert "No se pueden obtener resultados." in capsys.readouterr().out
+
+
+def _stream_sse(*eventos) -> httpx.Response:
+    cuerpo = "".join(f"event: {evento}\ndata: {json.dumps(data)}\n\n" for evento, data in eventos)
+    return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=(": keep-alive\n\n" + cuerpo).encode())
+
+
+def test_sse_completed_event_fetches_results_without_polling(capsys):
+    """Con --sse, el evento 'completed' basta: no hay sondeos de estado antes de pedir resultados."""
+    pedidos = []
+
+    def handler(request):
+        pedidos.append(request.url.path + ("?" + request.url.query.decode() if request.url.query else ""))
+        if request.url.path.endswith("/events"):
+            return _stream_sse(
+                ("estado", {"estado": "procesando", "progreso": 50, "mensaje": "a medias"}),
+                ("completed", {"estado": "completado", "progreso": 100, "mensaje": "listo"}),
+            )
+        return _respuesta_resultados()
+
+    with _cliente(handler) as session:
+        api_client.monitorear_consulta(session, "http://api", "X", timeout=60, poll_interval=1, sse=True)
+    assert pedidos == ["/query/X/events", "/query/X?resultados=True"]
+    salida = capsys.readouterr().out
+    assert "Progreso: 50%" in salida and "total_archivos" in salida
+
+
+def test_sse_unavailable_falls_back_to_polling(monkeypatch):
+    """Si /events no existe (servidor antiguo), se sigue con sondeo periódico hasta completar."""
+    monkeypatch.setattr(api_client.time, "sleep", lambda segundos: None)
+    estados = iter([("procesando", 10), ("completado", 100)])
+    pedidos = []
+
+    def handler(request):
+        pedidos.append(request.url.path)
+        if request.url.path.endswith("/events"):
+            return httpx.Response(404)
+        if "resultados" in request.url.params:
+            return _respuesta_resultados()
+        return _respuesta_estado(*next(estados))
+
+    with _cliente(handler) as session:
+        api_client.monitorear_consulta(session, "http://api", "X", timeout=60, poll_interval=1, sse=True)
+    assert pedidos == ["/query/X/events", "/query/X", "/query/X", "/query/X"]
+
+
+def test_sse_error_event_ends_monitoring(capsys):
+    """El evento 'error' (consulta eliminada) termina el monitoreo sin volver al sondeo."""
+    pedidos = []
+
+    def handler(request):
+        pedidos.append(request.url.path)
+        return _stream_sse(("error", {"consulta_id": "X", "detail": "Consulta no encontrada"}))
+
+    with _cliente(handler) as session:
+        api_client.monitorear_consulta(session, "http://api", "X", timeout=60, poll_interval=1, sse=True)
+    assert pedidos == ["/query/X/events"]
+    assert "Consulta no encontrada" in capsys.readouterr().out
+
+
+def test_batch_mode_aggregates_one_line_per_file(tmp_path, monkeypatch, capsys):
+    """--batch crea una consulta por .json y reporta el estado final de cada archivo, incluidos los rechazados."""
+    (tmp_path / "a.json").write_text('{"id": "A"}')
+    (tmp_path / "b.json").write_text('{"id": "B"}')
+    (tmp_path / "c.json").write_text('{"id": "C"}')
+    sondeos = {"A": iter([("procesando", 50), ("completado", 100)]), "B": iter([("error", 0)])}
+
+    def handler(request):
+        if request.method == "POST":
+            consulta_id = json.loads(request.content)["id"]
+            if consulta_id == "C":
+                return httpx.Response(400, text="solicitud inválida")
+            return httpx.Response(200, json={"consulta_id": consulta_id})
+        consulta_id = request.url.path.rsplit("/", 1)[-1]
+        estado, progreso = next(sondeos[consulta_id])
+        return httpx.Response(200, json={"estado": estado, "progreso": progreso, "mensaje": ""})
+
+    monkeypatch.setattr(httpx, "AsyncHTTPTransport", lambda **kw: httpx.MockTransport(handler))
+
+    asyncio.run(api_client._monitorear_lote("http://api", str(tmp_path), timeout=30, poll_interval=0))
+
+    ultimas = {}
+    for linea in capsys.readouterr().out.splitlines():
+        nombre, _, estado = linea.partition(": ")
+        if nombre.endswith(".json"):
+            ultimas[nombre] = estado
+    assert ultimas == {
+        "a.json": "[A] completado | 100% | ",
+        "b.json": "[B] error | 0% | ",
+        "c.json": "❌ HTTP 400: solicitud inválida",
+    }
+
+
+def test_batch_mode_retries_transient_errors_and_honours_gzip(tmp_path, monkeypatch, capsys):
+    """--batch usa los mismos reintentos que el modo de un archivo y envía el cuerpo con gzip si se pide."""
+    (tmp_path / "a.json").write_text('{"id": "A"}')
+    estados_post = iter([503, 200])
+    estados_get = iter([502, 200])
+    pedidos = []
+
+    def handler(request):
+        pedidos.append(request.method)
+        if request.method == "POST":
+            assert request.headers["Content-Encoding"] == "gzip"
+            assert json.loads(gzip.decompress(request.content)) == {"id": "A"}
+            return httpx.Response(next(estados_post), json={"consulta_id": "A"})
+        return httpx.Response(next(estados_get), json={"estado": "completado", "progreso": 100, "mensaje": ""})
+
+    monkeypatch.setattr(httpx, "AsyncHTTPTransport", lambda **kw: httpx.MockTransport(handler))
+
+    asyncio.run(api_client._monitorear_lote("http://api", str(tmp_path), timeout=30, poll_interval=0, usar_gzip=True))
+    assert pedidos == ["POST", "POST", "GET", "GET"]
+    assert "a.json: [A] completado | 100% | " in capsys.readouterr().out
+
+
+def test_streamed_results_are_read_completely(capsys):
+    """Resultados grandes se decodifican en streaming sin perder archivos entre trozos."""
+    pytest.importorskip("ijson")
+    archivos = [f"OR_ABI-L1b-RadF-M6C13_G16_s2023001{i:06d}_e1_c1.nc" for i in range(6000)]
+    cuerpo = json.dumps({
+        "consulta_id": "X",
+        "resultados": {"fuentes": {"lustre": {"archivos": archivos, "total": len(archivos)}}, "total_archivos": len(archivos)},
+    }).encode()
+    assert len(cuerpo) > api_client.UMBRAL_STREAMING_BYTES
+
+    def handler(request):
+        # Trozos pequeños y desparejos: los límites caen en mitad de nombres y claves
+        return httpx.Response(200, content=iter([cuerpo[i:i + 999] for i in range(0, len(cuerpo), 999)]),
+                              headers={"Content-Length": str(len(cuerpo))})
+
+    with _cliente(handler) as session:
+        api_client.imprimir_resultados(session, "/query/X?resultados=True")
+    salida = capsys.readouterr().out
+    listados = [linea.strip() for linea in salida.splitlines() if linea.strip().startswith("[lustre]")]
+    assert listados == [f"[lustre] {nombre}" for nombre in archivos]
+    assert "lustre: 6000 archivos listados" in salida
+    assert "total_archivos: 6000" in salida
@@ -1,11 +1,19 @@
+import errno
+import io
+import logging
 import os
 import tarfile
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import time
 import pytest
 from fastapi.testclient import TestClient
+from pebble import ThreadPool
 import main
-from recover import RecoverFiles
+import recover
+import s3_recover
+from recover import RecoverFiles, _process_safe_recover_file
 from database import ConsultasDatabase
 
 TEST_DB_PATH = "test_consultas_recover.db"
@@ -74,6 +82,8 @@ def test_recover_lustre_copies_tgz_for_all_cases(monkeypatch, override_db_and_re
     - L2 + productos=ALL + bandas=ALL
     """
     src = override_db_and_recover["source_dir"]
+    # S3 no tiene nada que agregar: la prueba no sale a la red
+    monkeypatch.setattr(override_db_and_recover["recover"].s3, "discover_files", lambda *a, **kw: {})
 
     # Crear un .tgz con nombre compatible para 2023-10-26 12:00 (YYYY=2023, JJJ=299, HHMM=1200)
     anio = 2023
@@ -130,6 +140,150 @@ def test_recover_lustre_copies_tgz_for_all_cases(monkeypatch, override_db_and_re
     assert any(f.endswith(".tgz") for f in lustre_files), f"Lustre no devolvió .tgz: {lustre_files}"
 
 
+class _S3Falso:
+    """
+    Sustituto de s3fs.S3FileSystem: ls(prefijo) devuelve el prefijo seguido de cada
+    nombre que genera `nombres(prefijo)` y registra (prefijo, refresh) de cada llamada.
+    """
+
+    def __init__(self, nombres=lambda prefijo: []):
+        self.nombres = nombres
+        self.listados = []
+
+    def ls(self, prefijo, refresh=False):
+        self.listados.append((prefijo, refresh))
+        return [f"{prefijo}{nombre}" for nombre in self.nombres(prefijo)]
+
+
+@pytest.fixture
+def s3_falso(monkeypatch):
+    """Instala un _S3Falso como s3fs.S3FileSystem; se llama con la función prefijo -> nombres."""
+
+    def instalar(nombres=lambda prefijo: []):
+        falso = _S3Falso(nombres)
+        monkeypatch.setattr(s3_recover.s3fs, "S3FileSystem", lambda *args, **kwargs: falso)
+        return falso
+
+    return instalar
+
+
+def _partes_prefijo(prefijo: str) -> tuple:
+    """('ABI-L1b-RadF', '2023', '299', '12') de 'noaa-goes16/ABI-L1b-RadF/2023/299/12/'."""
+    return tuple(prefijo.rstrip("/").split("/")[-4:])
+
+
+def _seis_escaneos_c13(prefijo):
+    """Seis escaneos C13 (cada 10 min) de la hora del prefijo."""
+    _, anio, dia, hora = _partes_prefijo(prefijo)
+    return [f"OR_ABI-L1b-RadF-M6C13_G16_s{anio}{dia}{hora}{m:02d}000_e1_c1.nc" for m in range(0, 60, 10)]
+
+
+def test_recover_s3_fills_scans_missing_from_lustre(monkeypatch, override_db_and_recover, s3_falso):
+    """
+    Una hora con un solo escaneo en Lustre no cuenta como cubierta: S3 se consulta
+    y solo se descargan los escaneos que Lustre no tenía.
+    """
+    src = override_db_and_recover["source_dir"]
+    recuperador = override_db_and_recover["recover"]
+    s3_falso(_seis_escaneos_c13)
+    pedidos = []
+
+    def fake_download_files(consulta_id, objetivos, dest, db):
+        pedidos.extend(objetivos)
+        return [], []
+
+    monkeypatch.setattr(recuperador.s3, "download_files", fake_download_files)
+
+    base = src / "abi" / "l1b" / "fd" / "2023" / "43"
+    base.mkdir(parents=True, exist_ok=True)
+    _create_dummy_tgz(base / "ABI-L1B-RadF-M6_GEAST-s20232991200.tgz", [
+        "OR_ABI-L1B-RadF-M6C13_GEAST_s20232991200_e..._c....nc",
+    ])
+
+    monkeypatch.setattr("main.generar_id_consulta", lambda: "TEST_RECOV_S3_GAP_FILL")
+    r = client.post("/query", json={
+        "nivel": "L1b", "dominio": "fd", "bandas": ["13"],
+        "fechas": {"20231026": ["12:00-12:59"]},
+    })
+    assert r.status_code == 200
+    assert _wait_until_completed("TEST_RECOV_S3_GAP_FILL")
+    assert sorted(Path(p).name.split("_s")[1][:11] for p in pedidos) == [f"202329912{m}0" for m in range(1, 6)]
+
+
+def test_recover_s3_skips_downloads_for_an_hour_lustre_covered(monkeypatch, override_db_and_recover, s3_falso):
+    """
+    Con un rango horario ('12:00-12:59') y los seis escaneos de la hora ya en Lustre,
+    S3 lista la hora pero no descarga nada.
+    """
+    src = override_db_and_recover["source_dir"]
+    recuperador = override_db_and_recover["recover"]
+    s3_falso(_seis_escaneos_c13)
+    pedidos = []
+
+    def fake_download_files(consulta_id, objetivos, dest, db):
+        pedidos.extend(objetivos)
+        return [], []
+
+    monkeypatch.setattr(recuperador.s3, "download_files", fake_download_files)
+
+    base = src / "abi" / "l1b" / "fd" / "2023" / "43"
+    base.mkdir(parents=True, exist_ok=True)
+    for minuto in range(0, 60, 10):
+        _create_dummy_tgz(base / f"ABI-L1B-RadF-M6_GEAST-s202329912{minuto:02d}.tgz", [
+            f"OR_ABI-L1B-RadF-M6C13_GEAST_s202329912{minuto:02d}_e..._c....nc",
+        ])
+
+    monkeypatch.setattr("main.generar_id_consulta", lambda: "TEST_RECOV_S3_HOUR_COVERED")
+    r = client.post("/query", json={
+        "nivel": "L1b", "dominio": "fd", "bandas": ["13"],
+        "fechas": {"20231026": ["12:00-12:59"]},
+    })
+    assert r.status_code == 200
+    assert _wait_until_completed("TEST_RECOV_S3_HOUR_COVERED")
+    assert pedidos == []
+    res = client.get("/query/TEST_RECOV_S3_HOUR_COVERED?resultados=true").json()["resultados"]
+    assert res["fuentes"]["lustre"]["total"] == 6
+
+
+def _un_escaneo_por_producto(prefijo):
+    """Un escaneo por hora del producto del prefijo, con banda C13 si es CMIP."""
+    producto, anio, dia, hora = _partes_prefijo(prefijo)
+    banda = "C13" if producto.startswith("ABI-L2-CMIP") else ""
+    return [f"OR_{producto}-M6{banda}_G16_s{anio}{dia}{hora}00000_e1_c1.nc"]
+
+
+def test_recover_s3_fills_products_missing_from_lustre(monkeypatch, override_db_and_recover, s3_falso):
+    """
+    Un escaneo cuyo .tgz de Lustre solo trae CMIP no cubre una consulta CMIP+ACHA:
+    S3 se consulta igual y solo se descarga el ACHA que faltaba.
+    """
+    src = override_db_and_recover["source_dir"]
+    recuperador = override_db_and_recover["recover"]
+    s3_falso(_un_escaneo_por_producto)
+    pedidos = []
+
+    def fake_download_files(consulta_id, objetivos, dest, db):
+        pedidos.extend(objetivos)
+        return [], []
+
+    monkeypatch.setattr(recuperador.s3, "download_files", fake_download_files)
+
+    base = src / "abi" / "l2" / "fd" / "2023" / "43"
+    base.mkdir(parents=True, exist_ok=True)
+    _create_dummy_tgz(base / "ABI-L2F-M6_GEAST-s20232991200.tgz", [
+        "CG_ABI-L2-CMIPF-M6C13_GEAST_s20232991200_e..._c....nc",
+    ])
+
+    monkeypatch.setattr("main.generar_id_consulta", lambda: "TEST_RECOV_S3_PRODUCT_GAP")
+    r = client.post("/query", json={
+        "nivel": "L2", "dominio": "fd", "productos": ["CMIP", "ACHA"], "bandas": ["13"],
+        "fechas": {"20231026": ["12:00"]},
+    })
+    assert r.status_code == 200
+    assert _wait_until_completed("TEST_RECOV_S3_PRODUCT_GAP")
+    assert [Path(p).name for p in pedidos] == ["OR_ABI-L2-ACHAF-M6_G16_s20232991200000_e1_c1.nc"]
+
+
 def test_recover_s3_never_returns_tgz(monkeypatch, override_db_and_recover):
     """
     Verifica que el recover real NUNCA genere .tgz desde S3,
@@ -137,7 +291,7 @@ def test_recover_s3_never_returns_tgz(monkeypatch, override_db_and_recover):
     Mockeamos S3 para evitar red externa.
     """
     # Mock de discover_files para devolver rutas S3 simuladas (.nc)
-    def fake_discover_files(query, goes19_date):
+    def fake_discover_files(query, goes19_date, **kwargs):
         # Simular hallazgo de un par de archivos .nc
         return {
             f"OR_ABI-L2-ACHAF-M6_GEAST_s20230011200_e..._c....nc": "s3://noaa-goes16/ABI-L2-ACHAF/2023/001/12/OR_ABI-L2-ACHAF-M6_GEAST_s20230011200_e..._c....nc",
@@ -194,3 +348,387 @@ def test_recover_s3_never_returns_tgz(monkeypatch, override_db_and_recover):
     assert s3_files, "S3 no devolvió archivos"
     assert all(f.endswith(".nc") for f in s3_files), f"S3 devolvió no .nc: {s3_files}"
     assert all(not f.endswith(".tgz") for f in s3_files)
+
+
+@pytest.mark.parametrize("descompresor", ["", "gzip"])
+@pytest.mark.parametrize("concurrencia", [1, 4])
+def test_process_safe_recover_file_extracts_selectively(tmp_path, monkeypatch, concurrencia, descompresor):
+    """
+    Extracción selectiva en una sola pasada: solo se extraen los miembros
+    que coinciden con productos/bandas; si nada coincide se lanza FileNotFoundError.
+    """
+
+    monkeypatch.setattr(recover, "EXTRACT_CONCURRENCY", concurrencia)
+    # "gzip -dc" ejercita la misma tubería que pigz cuando está instalado
+    monkeypatch.setattr(recover, "EXTRACT_GZIP_CMD", descompresor)
+    tgz = tmp_path / "OR_ABI-L2-M6_G16-s20230011200.tgz"
+    _create_dummy_tgz(tgz, [
+        "CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc",
+        "CG_ABI-L2-CMIPF-M6C02_G16_s20230011200000_e1_c1.nc",
+        "CG_ABI-L2-ACHAF-M6_G16_s20230011200000_e1_c1.nc",
+        "CG_ABI-L2-ACTPF-M6_G16_s20230011200000_e1_c1.nc",
+    ])
+    destino = tmp_path / "dest"
+    destino.mkdir()
+
+    recuperados = _process_safe_recover_file(tgz, destino, "L2", ["CMIP", "ACHA"], ["13"])
+    nombres = sorted(p.name for p in recuperados)
+    assert nombres == [
+        "CG_ABI-L2-ACHAF-M6_G16_s20230011200000_e1_c1.nc",
+        "CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc",
+    ]
+    assert sorted(p.name for p in destino.iterdir()) == nombres
+
+    with pytest.raises(FileNotFoundError):
+        _process_safe_recover_file(tgz, destino, "L2", ["RRQPE"], [])
+
+
+def test_external_decompressor_with_noisy_stderr_does_not_block(tmp_path, monkeypatch):
+    """Un descompresor que escribe en stderr más de lo que cabe en un pipe no bloquea la extracción."""
+
+    ruidoso = tmp_path / "gzip-ruidoso"
+    ruidoso.write_text('#!/bin/sh\nhead -c 262144 /dev/zero | tr "\\0" w >&2\nexec gzip "$@"\n')
+    ruidoso.chmod(0o755)
+    monkeypatch.setattr(recover, "EXTRACT_GZIP_CMD", str(ruidoso))
+    tgz = tmp_path / "OR_ABI-L2-M6_G16-s20230011200.tgz"
+    _create_dummy_tgz(tgz, ["CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc"])
+    destino = tmp_path / "dest"
+    destino.mkdir()
+
+    resultado = []
+    hilo = threading.Thread(
+        target=lambda: resultado.extend(_process_safe_recover_file(tgz, destino, "L2", ["CMIP"], ["13"])),
+        daemon=True,
+    )
+    hilo.start()
+    hilo.join(10)
+    assert not hilo.is_alive(), "la extracción quedó bloqueada"
+    assert [p.name for p in resultado] == ["CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc"]
+
+
+def test_process_safe_recover_file_overlaps_member_writes(tmp_path, monkeypatch):
+    """
+    Con EXTRACT_CONCURRENCY > 1 la escritura de un miembro no bloquea la lectura del
+    siguiente: las dos primeras escrituras deben estar en curso a la vez (si fueran
+    secuenciales, la barrera vencería).
+    """
+
+    monkeypatch.setattr(recover, "EXTRACT_CONCURRENCY", 4)
+    barrera = threading.Barrier(2, timeout=5)
+    llamadas = []
+    escribir_original = recover._escribir_miembro
+
+    def escribir_en_paralelo(destino, bloques, cupo):
+        llamadas.append(destino.name)
+        if len(llamadas) <= 2:
+            barrera.wait()
+        escribir_original(destino, bloques, cupo)
+
+    monkeypatch.setattr(recover, "_escribir_miembro", escribir_en_paralelo)
+    tgz = tmp_path / "OR_ABI-L1b-M6_G16-s20230011200.tgz"
+    nombres = [f"OR_ABI-L1b-RadF-M6C{b:02d}_G16_s20230011200000_e1_c1.nc" for b in range(1, 4)]
+    # Miembros de varios bloques de 1 MiB, con contenido distinto por miembro
+    contenidos = {nombre: os.urandom(1024) * (2560 + i) for i, nombre in enumerate(nombres)}
+    with tarfile.open(tgz, "w:gz") as tar:
+        for nombre, datos in contenidos.items():
+            info = tarfile.TarInfo(name=nombre)
+            info.size = len(datos)
+            tar.addfile(info, io.BytesIO(datos))
+    destino = tmp_path / "dest"
+    destino.mkdir()
+
+    recuperados = _process_safe_recover_file(tgz, destino, "L1b", [], ["01", "02", "03"])
+    assert not barrera.broken
+    assert sorted(p.name for p in recuperados) == nombres
+    assert sorted(llamadas) == nombres
+    assert all((destino / nombre).read_bytes() == datos for nombre, datos in contenidos.items())
+
+
+@pytest.mark.parametrize("flujos", [1, 4])
+def test_sendfile_copy_preserves_content(tmp_path, monkeypatch, flujos):
+    """La copia de .tgz completos (un flujo o varios rangos en paralelo) es idéntica al original."""
+    monkeypatch.setattr(recover, "COPY_STREAMS", flujos)
+    monkeypatch.setattr(recover, "COPY_PARALLEL_MIN_BYTES", 1)
+    monkeypatch.setattr(recover, "_BLOQUE_COPIA", 4096)
+    origen = tmp_path / "origen.tgz"
+    origen.write_bytes(os.urandom(3 * 65536 + 7))
+    destino = tmp_path / "destino.tgz"
+    recover._sendfile_copy(origen, destino)
+    assert destino.read_bytes() == origen.read_bytes()
+
+
+def test_build_recovery_query_maps_failed_files_to_original_ranges(override_db_and_recover):
+    """Cada archivo fallido se asocia a su clave de fecha y rango horario originales, sin duplicados."""
+    recuperador = override_db_and_recover["recover"]
+    query = {"_original_request": {
+        "sat": "GOES-16",
+        "creado_por": "tester",
+        "fechas": {
+            "20230110": ["00:00-23:59"],
+            "20230101-20230105": ["11:00-12:30", "15:00"],
+        },
+    }}
+    fallidos = [
+        Path("OR_ABI-L1b-RadF-s20230011215.tgz"),
+        Path("OR_ABI-L1b-RadF-s20230011230.tgz"),
+        Path("OR_ABI-L1b-RadF-s20230031500.tgz"),
+        Path("OR_ABI-L1b-RadF-s20230071300.tgz"),  # fuera de cualquier clave
+        Path("sin_timestamp.tgz"),
+    ]
+    consulta = recuperador._build_recovery_query("ID", fallidos, query)
+    assert consulta["fechas"] == {"20230101-20230105": ["11:00-12:30", "15:00"]}
+    assert "creado_por" not in consulta
+    assert recuperador._build_recovery_query("ID", [], query) is None
+
+
+def test_recover_routes_selective_extraction_to_cpu_executor(monkeypatch, override_db_and_recover, executor_inmediato):
+    """Con cpu_executor, la extracción selectiva se agenda en él; la copia de .tgz completos no."""
+    src = override_db_and_recover["source_dir"]
+    recuperador = override_db_and_recover["recover"]
+    cpu = executor_inmediato
+    monkeypatch.setattr(recuperador, "cpu_executor", cpu)
+    monkeypatch.setattr(recuperador, "s3_fallback_enabled", False)
+
+    base_l2 = src / "abi" / "l2" / "fd" / "2023" / "43"
+    base_l2.mkdir(parents=True, exist_ok=True)
+    _create_dummy_tgz(base_l2 / "ABI-L2F-M6_GEAST-s20232991200.tgz", [
+        "CG_ABI-L2-CMIPF-M6C13_GEAST_s20232991200_e..._c....nc",
+        "CG_ABI-L2-CMIPF-M6C02_GEAST_s20232991200_e..._c....nc",
+    ])
+
+    monkeypatch.setattr("main.generar_id_consulta", lambda: "TEST_RECOV_CPU_EXECUTOR")
+    r = client.post("/query", json={
+        "nivel": "L2", "productos": ["CMIP"], "bandas": ["13"], "dominio": "fd",
+        "fechas": {"20231026": ["12:00"]},
+    })
+    assert r.status_code == 200
+    assert _wait_until_completed("TEST_RECOV_CPU_EXECUTOR")
+    assert [Path(args[0]).name for args in cpu.tareas] == ["ABI-L2F-M6_GEAST-s20232991200.tgz"]
+    res = client.get("/query/TEST_RECOV_CPU_EXECUTOR?resultados=true").json()["resultados"]
+    assert res["fuentes"]["lustre"]["archivos"] == ["CG_ABI-L2-CMIPF-M6C13_GEAST_s20232991200_e..._c....nc"]
+
+
+def test_esperar_tareas_marks_hung_thread_tasks_as_expired(override_db_and_recover, monkeypatch):
+    """Con ThreadPool, una tarea que excede FILE_PROCESSING_TIMEOUT_SECONDS se entrega como vencida."""
+    recuperador = override_db_and_recover["recover"]
+    monkeypatch.setattr(recuperador, "FILE_PROCESSING_TIMEOUT_SECONDS", 0.2)
+    liberar = threading.Event()
+    pool = ThreadPool(max_workers=2)
+    try:
+        colgada = pool.schedule(liberar.wait, args=(30,))
+        rapida = pool.schedule(sum, args=([1, 2],))
+        inicio = time.monotonic()
+        resultados = dict(recuperador._esperar_tareas([colgada, rapida], pool))
+        assert time.monotonic() - inicio < 5
+        assert resultados == {rapida: False, colgada: True}
+    finally:
+        liberar.set()
+        pool.close()
+        pool.join()
+
+
+def test_process_safe_recover_file_rejects_unsafe_members(tmp_path):
+    """Miembros con rutas absolutas, '..' o que no son archivos regulares no se escriben."""
+    tgz = tmp_path / "OR_ABI-L2-M6_G16-s20230011200.tgz"
+    with tarfile.open(tgz, "w:gz") as tar:
+        for nombre in [
+            "CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc",
+            "../CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_fuera.nc",
+            "/tmp/CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_absoluto.nc",
+        ]:
+            tar.addfile(tarfile.TarInfo(name=nombre))
+        enlace = tarfile.TarInfo(name="CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_enlace.nc")
+        enlace.type = tarfile.SYMTYPE
+        enlace.linkname = "/etc/passwd"
+        tar.addfile(enlace)
+    destino = tmp_path / "dest"
+    destino.mkdir()
+
+    recuperados = _process_safe_recover_file(tgz, destino, "L2", ["CMIP"], ["13"])
+    assert [p.name for p in recuperados] == ["CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc"]
+    assert sorted(p.name for p in destino.iterdir()) == ["CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc"]
+    assert not (tmp_path / "CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_fuera.nc").exists()
+    assert not Path("/tmp/CG_ABI-L2-CMIPF-M6C13_G16_s20230011200000_absoluto.nc").exists()
+
+
+def test_process_safe_recover_file_copies_tgz_for_explicit_full_band_list(tmp_path):
+    """Pedir las 16 bandas una por una equivale a 'ALL' en L1b: se copia el .tgz completo."""
+    tgz = tmp_path / "ABI-L1B-RadF-M6_GEAST-s20230011200.tgz"
+    _create_dummy_tgz(tgz, [f"OR_ABI-L1B-RadF-M6C{b:02d}_GEAST_s20230011200_e..._c....nc" for b in range(1, 17)])
+    destino = tmp_path / "dest"
+    destino.mkdir()
+
+    recuperados = _process_safe_recover_file(tgz, destino, "L1b", [], [f"{b:02d}" for b in range(1, 17)])
+    assert recuperados == [destino / tgz.name]
+    assert sorted(p.name for p in destino.iterdir()) == [tgz.name]
+
+
+class _DBProgreso:
+    """Registra los mensajes de progreso que escribe download_files."""
+
+    def __init__(self):
+        self.mensajes = []
+
+    def actualizar_estado(self, consulta_id, estado, progreso, mensaje):
+        self.mensajes.append(mensaje)
+
+
+def _descargar_con_progreso(tmp_path, monkeypatch, intervalo):
+    monkeypatch.setattr(s3_recover, "PROGRESS_UPDATE_INTERVAL_SECONDS", intervalo)
+    s3 = s3_recover.S3RecoverFiles(logging.getLogger(__name__), 4, 1, 0)
+    monkeypatch.setattr(s3, "_get_s3", lambda: None)
+    monkeypatch.setattr(s3, "_download_single_s3_objective", lambda cid, ruta, destino, cliente, db: destino / ruta.rsplit("/", 1)[-1])
+    db = _DBProgreso()
+
+    objetivos = [f"noaa-goes16/ABI-L1b-RadF/2023/001/12/OR_ABI-L1b-RadF-M6C13_G16_s2023001120{i:04d}_e1_c1.nc" for i in range(250)]
+    recuperados, fallidos = s3.download_files("TEST_S3_PROGRESS", objetivos, tmp_path, db)
+    assert len(recuperados) == 250 and fallidos == []
+    return db.mensajes
+
+
+def test_s3_download_progress_is_written_only_when_the_percentage_changes(tmp_path, monkeypatch):
+    """Aunque el intervalo ya haya pasado, solo se escribe cuando cambia el porcentaje (85-95)."""
+
+    mensajes = _descargar_con_progreso(tmp_path, monkeypatch, 0)
+    assert mensajes == [f"S3 progreso: {n}/250" for n in range(0, 251, 25)]
+
+
+def test_s3_download_progress_waits_for_the_interval(tmp_path, monkeypatch):
+    """Dentro del intervalo no se escribe aunque cambie el porcentaje; la última escritura siempre ocurre."""
+
+    mensajes = _descargar_con_progreso(tmp_path, monkeypatch, 3600)
+    assert mensajes == ["S3 progreso: 0/250", "S3 progreso: 250/250"]
+
+
+def test_s3_discover_files_refreshes_listings_of_the_current_day(s3_falso):
+    """Los prefijos del día en curso se listan sin caché; los días pasados pueden usarla."""
+
+    s3 = s3_recover.S3RecoverFiles(logging.getLogger(__name__), 4, 1, 0)
+    falso = s3_falso()
+    hoy = datetime.now(timezone.utc)
+    ayer = hoy - timedelta(days=1)
+    fechas = {hoy.strftime("%Y%j"): ["00:00"], ayer.strftime("%Y%j"): ["00:00"]}
+
+    s3.discover_files({"satelite": "GOES-16", "nivel": "L1b", "bandas": ["13"], "fechas": fechas}, datetime(2025, 4, 1))
+    refrescos = {"".join(_partes_prefijo(prefijo)[1:3]): refresh for prefijo, refresh in falso.listados}
+    assert refrescos == {hoy.strftime("%Y%j"): True, ayer.strftime("%Y%j"): False}
+
+
+def test_lustre_week_listing_is_not_cached_for_the_current_week(tmp_path):
+    """Un .tgz que llega a la semana en curso se ve en el siguiente listado; las semanas pasadas usan la caché."""
+
+    recover._listar_semana.cache_clear()
+    lustre = recover.LustreRecoverFiles(str(tmp_path), logging.getLogger(__name__))
+    hoy = datetime.now(timezone.utc).strftime("%Y%j")
+    for fecha_jjj in (hoy, "2023299"):
+        semana = (int(fecha_jjj[4:]) - 1) // 7 + 1
+        (tmp_path / fecha_jjj[:4] / f"{semana:02d}").mkdir(parents=True)
+
+    def nuevo_tgz(fecha_jjj, hhmm):
+        semana = (int(fecha_jjj[4:]) - 1) // 7 + 1
+        _create_dummy_tgz(tmp_path / fecha_jjj[:4] / f"{semana:02d}" / f"ABI-L1B-RadF-M6_GEAST-s{fecha_jjj}{hhmm}.tgz", [])
+
+    for fecha_jjj in (hoy, "2023299"):
+        nuevo_tgz(fecha_jjj, "1200")
+        assert len(lustre.find_files_for_day(tmp_path, fecha_jjj)) == 1
+        nuevo_tgz(fecha_jjj, "1210")
+    assert len(lustre.find_files_for_day(tmp_path, hoy)) == 2
+    assert len(lustre.find_files_for_day(tmp_path, "2023299")) == 1
+
+
+def _cmi_dos_bandas_y_acha(prefijo):
+    """Bandas C02 y C13 si el producto es CMIP; un solo archivo sin banda si no."""
+    producto = _partes_prefijo(prefijo)[0]
+    if "CMIP" in producto:
+        return [f"OR_{producto}-M6C{b}_G16_s20230011200000_e1_c1.nc" for b in ("02", "13")]
+    return [f"OR_{producto}-M6_G16_s20230011200000_e1_c1.nc"]
+
+
+def test_s3_discover_files_applies_bandas_only_to_cmi(s3_falso):
+    """Una sola llamada a discover_files filtra por banda los CMI* y conserva ACHA completo."""
+    falso = s3_falso(_cmi_dos_bandas_y_acha)
+
+    s3 = s3_recover.S3RecoverFiles(logging.getLogger(__name__), 1, 1, 0)
+    query = {"sat": "GOES-16", "nivel": "L2", "dominio": "fd", "productos": ["CMIP", "ACHA"],
+             "bandas": ["13"], "fechas": {"2023001": ["12:00", "12:00-12:30"]}}
+    encontrados = s3.discover_files(query, datetime(2025, 4, 1, tzinfo=timezone.utc))
+
+    assert sorted(encontrados) == [
+        "OR_ABI-L2-ACHAF-M6_G16_s20230011200000_e1_c1.nc",
+        "OR_ABI-L2-CMIPF-M6C13_G16_s20230011200000_e1_c1.nc",
+    ]
+    # un listado por producto y hora, aunque dos rangos compartan la hora 12
+    assert len(falso.listados) == 2
+
+
+def test_s3_slow_get_is_hedged(monkeypatch, tmp_path):
+    """Un GET que excede el plazo dispara un segundo GET; gana el primero que termina y no quedan temporales."""
+    monkeypatch.setattr(s3_recover, "S3_HEDGE_MIN_SECONDS", 0.05)
+    liberar_lento = threading.Event()
+    temporal_borrado = threading.Event()
+    borrar_original = s3_recover._borrar_temporal
+
+    def borrar_y_avisar(ruta):
+        borrar_original(ruta)
+        temporal_borrado.set()
+
+    monkeypatch.setattr(s3_recover, "_borrar_temporal", borrar_y_avisar)
+
+    class _ClienteLento:
+        llamadas = 0
+
+        def get(self, remoto, local):
+            _ClienteLento.llamadas += 1
+            if _ClienteLento.llamadas == 1:
+                liberar_lento.wait(5)  # el primer GET queda colgado hasta que termine el de respaldo
+            Path(local).write_bytes(b"datos")
+
+    carpeta = tmp_path / "s3"
+    carpeta.mkdir()
+    s3 = s3_recover.S3RecoverFiles(logging.getLogger(__name__), 1, 1, 0)
+    s3._ewma_get_s = 0.01  # ya hay una muestra previa
+    destino = s3._download_single_s3_objective("ID", "bucket/OR_x_s20230011200_e1.nc", carpeta, _ClienteLento(), None)
+    assert not temporal_borrado.is_set()
+    liberar_lento.set()
+
+    assert destino == carpeta / "OR_x_s20230011200_e1.nc"
+    assert destino.read_bytes() == b"datos"
+    assert _ClienteLento.llamadas == 2
+    # el GET perdedor termina y borra su temporal
+    assert temporal_borrado.wait(5)
+    assert sorted(p.name for p in carpeta.iterdir()) == ["OR_x_s20230011200_e1.nc"]
+
+
+class _ClienteConErrores:
+    """Cliente S3 falso cuyo get() lanza los errores dados en orden y luego escribe el archivo."""
+
+    def __init__(self, errores):
+        self.errores = list(errores)
+        self.llamadas = 0
+
+    def get(self, remoto, local):
+        self.llamadas += 1
+        if self.errores:
+            raise self.errores.pop(0)
+        Path(local).write_bytes(b"datos")
+
+
+def test_s3_missing_key_fails_without_retrying(tmp_path):
+    """Un 404 de S3 (FileNotFoundError sin errno) falla al primer intento."""
+    s3 = s3_recover.S3RecoverFiles(logging.getLogger(__name__), 1, 3, 0)
+    cliente = _ClienteConErrores([FileNotFoundError("The specified key does not exist.")])
+
+    with pytest.raises(FileNotFoundError):
+        s3._download_single_s3_objective("ID", "bucket/OR_x_s20230011200_e1.nc", tmp_path, cliente, None)
+    assert cliente.llamadas == 1
+
+
+def test_s3_local_enoent_is_retried(tmp_path):
+    """Un ENOENT local durante la descarga no se confunde con un 404: se reintenta."""
+    s3 = s3_recover.S3RecoverFiles(logging.getLogger(__name__), 1, 3, 0)
+    local = tmp_path / "OR_x_s20230011200_e1.nc"
+    cliente = _ClienteConErrores([FileNotFoundError(errno.ENOENT, "No such file or directory", str(local))])
+
+    destino = s3._download_single_s3_objective("ID", "bucket/OR_x_s20230011200_e1.nc", tmp_path, cliente, None)
+    assert destino == local and local.read_bytes() == b"datos"
+    assert cliente.llamadas == 2